@@ -29,44 +29,44 @@
 # In[7]:
 
 import os
+import sys
 import xml.etree.ElementTree as ET
+sys.path.append(os.path.join(os.path.dirname(os.getcwd()), "spe_common"))
+import file_scan
+import file_index
 
 
 # ## Functions to Collect Each AXML Model Fit and Write to File
 
+# Reads [zero, zero std, gain, gain std, noise, noise std, fano, fano std] from one AXML file
+
 # In[8]:
 
-def axml_calibration_to_csv(input_folder, output_folder, output_name):
+def read_calibration(path):
+    xml_tree = ET.parse(path)
+    xml_root = xml_tree.getroot()
+    model = xml_root[2]
+    calibration = model[0]
+    values = []
+    for param in calibration[0:4]:
+        values.append(float(param[2].text))
+        values.append(float(param[4].text))
+    return values
+
+
+# Passing index_path (a SQLite file, see file_index) reuses the values of files unchanged since the last run
+
+# In[ ]:
+
+def axml_calibration_to_csv(input_folder, output_folder, output_name, index_path=None):
     output_path = os.path.join(output_folder, (output_name + ".csv"))
     output_file = open(output_path, 'w+')
     output_file.write("FileName, Zero Val, Zero Std, Gain Val, Gain Std, Noise Val, Noise Std, Fano Val, Fano Std\n")
     
-    for root, dirs, files in os.walk(input_folder):
-        for file in files:
-            path = os.path.join(root, file)
-            name, ext = os.path.splitext(file)
-            if ext == '.axml':
-                xml_tree = ET.parse(path)
-                xml_root = xml_tree.getroot()
-                model = xml_root[2]
-                calibration = model[0]
-                zero = calibration[0]
-                gain = calibration[1]
-                noise = calibration[2]
-                fano = calibration[3]
-
-                zero_val = float(zero[2].text)
-                zero_std = float(zero[4].text)
-                gain_val = float(gain[2].text)
-                gain_std = float(gain[4].text)
-                noise_val = float(noise[2].text)
-                noise_std = float(noise[4].text)
-                fano_val = float(fano[2].text)
-                fano_std = float(fano[4].text)
-
-                output_file.write("{:s},{:.6e},{:.6e},{:.6e},{:.6e},{:.6e},{:.6e},{:.6e},{:.6e}\n".format(
-                    name, zero_val, zero_std, gain_val, gain_std, 
-                    noise_val, noise_std, fano_val, fano_std))
+    entries = file_scan.scan_sorted(input_folder, ".axml")
+    for entry, values in file_index.indexed(entries, read_calibration, index_path, "axml_calibration", prefix=input_folder):
+        name, ext = os.path.splitext(os.path.basename(entry.path))
+        output_file.write("{:s},{:.6e},{:.6e},{:.6e},{:.6e},{:.6e},{:.6e},{:.6e},{:.6e}\n".format(name, *values))
     output_file.close()
 
 
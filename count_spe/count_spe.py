@@ -7,7 +7,14 @@
 
 import os
 import re
+import sys
 import pandas as pd
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+sys.path.append(os.path.join(os.path.dirname(os.getcwd()), "spe_common"))
+import file_scan
+import file_index
+import spe_names
 
 
 # Regex tests
@@ -20,82 +27,84 @@ test_found = test_search.group(0)
 test_found
 
 
-# Building the data structure
+# Reading the hole and energy from a file name (None where not found). Passing index_path (a SQLite file, see file_index) to count_spe_files below reuses the results for files unchanged since the last run.
 
-# In[59]:
+# In[ ]:
 
-def build_ds(src_root):
-    users = os.listdir(src_root)
-    energies = set()
-    holes = set()
-    for root, dirs, files in os.walk(src_root):
-        for file in files:
-            if (file.find(".spe") != -1):
-                kV_search = re.search(r'.{1,2}kV', file)
-                try:
-                    kV_found = kV_search.group()
-                    kV_val = int(kV_found[0:-2])
-                    energies.add(kV_val)
-                except:
-                    pass
-                hole_search = re.search(r'U[a-zA-Z0-9]{4,5}', file)
-                try:
-                    hole_found = hole_search.group()
-                    holes.add(hole_found)
-                except:
-                    pass
-    energies = list(energies)
-    holes = list(holes)
-    stats_dict = {}
-    for user in users:
-        stats_dict[user] = {}
-        for hole in holes:
-            stats_dict[user][hole] = {}
-            for energy in energies:
-                stats_dict[user][hole][energy] = 0
-    return stats_dict
+## bump when parse_spe_name changes what it returns, so indexed results are parsed again ##
+name_version = 1
+
+def parse_spe_name(fpath):
+    info = spe_names.parse_name(os.path.basename(fpath))
+    return {'kV':info['kV'], 'hole':info['hole']}
+
+
+# Counting the files in one pass. Each user folder is scanned once into a sparse Counter of {(user, hole, kV): number of files}; files without a hole or energy in the name are not counted. The per-user Counters are computed on a pool of threads and added together.
+#
+# With an index, its rows under src_root are loaded once and shared (read-only) by the threads. Each thread returns the files it had to parse, and only the calling thread writes them to the index, over a single connection.
+
+# In[59]:
 
+def count_user(src_root, user, known=None):
+    counts = Counter()
+    new_entries = []
+    new_infos = []
+    seen_paths = []
+    src_dir = os.path.join(src_root, user)
+    for entry in file_scan.scan(src_dir, ".spe"):
+        if known is None:
+            info = parse_spe_name(entry.path)
+        else:
+            seen_paths.append(entry.path)
+            if file_index.is_current(known, entry, name_version):
+                info = file_index.stored(known, entry)
+            else:
+                info = parse_spe_name(entry.path)
+                new_entries.append(entry)
+                new_infos.append(info)
+        if (info['hole'] is not None) and (info['kV'] is not None):
+            counts[(user, info['hole'], info['kV'])] += 1
+    return counts, new_entries, new_infos, seen_paths
 
-# Counting the files
 
 # In[60]:
 
-def count_spe_files(src_root, stats_dict):
-    filled_stats = stats_dict.copy()
-    users = os.listdir(src_root)
-    for user in users:
-        src_dir = os.path.join(src_root, user)
-        for root, dirs, files in os.walk(src_dir):
-            for file in files:
-                if (file.find(".spe") != -1):
-                    kV_search = re.search(r'.{1,2}kV', file)
-                    hole_search = re.search(r'U[a-zA-Z0-9]{4,5}', file)
-                    try:
-                        kV_found = kV_search.group()
-                        kV_val = int(kV_found[0:-2])
-                        hole_found = hole_search.group()
-                        filled_stats[user][hole_found][kV_val] += 1
-                    except:
-                        pass
-    return filled_stats
-
-
-# Flattens the data structure to create a dataframe
+def count_spe_files(src_root, index_path=None, max_workers=8):
+    users = [user for user in os.listdir(src_root) if os.path.isdir(os.path.join(src_root, user))]
+    conn = None if (index_path is None) else file_index.open_index(index_path)
+    try:
+        known = None if (conn is None) else file_index.known_files(conn, "count_spe", src_root)
+        counts = Counter()
+        seen_paths = set()
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            for user_counts, new_entries, new_infos, user_paths in pool.map(lambda user: count_user(src_root, user, known), users):
+                counts.update(user_counts)
+                if conn is not None:
+                    file_index.store(conn, "count_spe", new_entries, new_infos, name_version)
+                    seen_paths.update(user_paths)
+        if conn is not None:
+            file_index.forget_missing(conn, "count_spe", seen_paths, src_root)
+    finally:
+        if conn is not None:
+            conn.close()
+    return counts, users
+
+
+# Builds the tables from the counts: detailed has a row for each (user, hole) with files and one column per energy; summary has a row per user (including users with no files) and one column per energy
 
 # In[65]:
 
-# want each row in form {'user':user, 'hole':hole, '9':0, '30':0, '50':0}
-
-def nested_dict_to_df(nested_dict):
-    flattened_list = []
-    for user in nested_dict:
-        for hole in nested_dict[user]:
-            row = {'user':user, 'hole':hole}
-            for energy in nested_dict[user][hole]:
-                row[energy] = nested_dict[user][hole][energy]
-            flattened_list.append(row)
-    flattened_df = pd.DataFrame(flattened_list)
-    return flattened_df
+def counts_to_tables(counts, users=None):
+    energies = sorted(set(kV for user, hole, kV in counts))
+    index = pd.MultiIndex.from_tuples(list(counts.keys()), names=['user','hole','kV'])
+    series = pd.Series(list(counts.values()), index=index, dtype=int)
+    detailed_df = series.unstack('kV', fill_value=0).reindex(columns=energies, fill_value=0)
+    detailed_df = detailed_df.sort_index().reset_index()
+    detailed_df.columns.name = None
+    summary_df = detailed_df.drop(columns='hole').groupby('user').sum()
+    if users is not None:
+        summary_df = summary_df.reindex(sorted(users), fill_value=0)
+    return detailed_df, summary_df
 
 
 # --- Runs the functions ---
@@ -106,29 +115,22 @@ src_root = 'F:\\363_Old_Host_PC\\Post-Bova_Sort'
 out_dir = os.path.join(os.getcwd(),"out")
 
 
-# In[63]:
-
-stats_dict = build_ds(src_root)
-
-
 # In[64]:
 
-filled_stats = count_spe_files(src_root, stats_dict)
-filled_stats
+counts, users = count_spe_files(src_root)
+detailed_df, summary_df = counts_to_tables(counts, users)
 
 
 # In[73]:
 
-flattened_df = nested_dict_to_df(filled_stats)
-flattened_df.to_csv(os.path.join(out_dir,"stats_detailed.csv"))
-flattened_df
+detailed_df.to_csv(os.path.join(out_dir,"stats_detailed.csv"))
+detailed_df
 
 
 # In[74]:
 
-grouped_df = flattened_df.groupby('user').sum()
-grouped_df.to_csv(os.path.join(out_dir,"stats_summary.csv"))
-grouped_df
+summary_df.to_csv(os.path.join(out_dir,"stats_summary.csv"))
+summary_df
 
 
 # Comparison test using counting in single pass
@@ -141,16 +143,15 @@ def count_spe_files_simple(src_root):
     for user in users:
         user_stats = {'user':user,9:0,30:0,50:0}
         src_dir = os.path.join(src_root, user)
-        for root, dirs, files in os.walk(src_dir):
-            for file in files:
-                if (file.find(".spe") != -1):
-                    kV_search = re.search(r'.{1,2}kV', file)
-                    try:
-                        kV_found = kV_search.group()
-                        kV_val = int(kV_found[0:-2])
-                        user_stats[kV_val] += 1
-                    except:
-                        pass
+        for entry in file_scan.scan(src_dir, ".spe"):
+            file = os.path.basename(entry.path)
+            kV_search = re.search(r'.{1,2}kV', file)
+            try:
+                kV_found = kV_search.group()
+                kV_val = int(kV_found[0:-2])
+                user_stats[kV_val] += 1
+            except:
+                pass
         all_stats.append(user_stats)
         stats_df = pd.DataFrame(all_stats)
     return stats_df
@@ -8,102 +8,78 @@
 # In[8]:
 
 import os
-import re
+import sys
 import numpy as np
 import pandas as pd
+sys.path.append(os.path.join(os.path.dirname(os.getcwd()), "spe_common"))
+import spe_io
+import file_scan
+import file_index
+import spe_names
 
 
 # In[34]:
 
 def get_stats(fpath):
-    with open(fpath) as f:
-        lines = f.readlines()
-    cpsLine = 1
-    timeLine = 1
-    cps = 0
-    measured = 0
-    actual = 0
-    for i,line in enumerate(lines):
-        if (line == "$TotalCPS:\n"):
-            cpsLine = i+1
-        if (line == "$MEAS_TIM:\n"):
-            timeLine = i+1
-    try:
-        cps = int(lines[cpsLine])
-        times = lines[timeLine].split()
-        measured = int(times[0])
-        actual = int(times[1])
-    except:
-        pass
-    stats = {"cps":cps, "meas":measured, "act":actual}
-    return stats
+    return spe_io.read_stats(fpath)
 
 
 # In[15]:
 
 def get_xrf_points_old(src_dir,out_dir):
     cols = ['sample','x','y','dc','cc','kV','cps','meas','act']
+    entries = file_scan.scan_sorted(src_dir, ".spe")
+    names = spe_names.parse_names([os.path.basename(entry.path) for entry in entries], scheme='old')
+    complete = names[['x','y','dc','cc','kV']].notna().all(axis=1).values
+    stats_list = spe_io.read_stats_batch([entry.path for entry, success in zip(entries, complete) if success])
+    stats_iter = iter(stats_list)
     rows_list = []
-    for root, dirs, files in os.walk(src_dir):
-        for fn in files:
-            success = True
-            if (fn.find(".spe") != -1):
-                fn_pts = fn.split()
-                sample = fn_pts[0]
-                x_search = re.search(r'X\s*.{3,6}mm', fn)
-                x = x_search.group()
-                y_search = re.search(r'Y\s*.{1,6}mm', fn)
-                y = y_search.group()
-                dc_search = re.search(r'DC\s*.{1,6}mm', fn)
-                dc = dc_search.group()
-                cc_search = re.search(r'CC\s*.{1,6}mm', fn)
-                cc = cc_search.group()
-                kV_search = re.search(r'.{1,2}kV', fn)
-                kV = kV_search.group()
-                try:
-                    x = float(x[1:-2])
-                    y = float(y[1:-2])
-                    dc = float(dc[2:-2])
-                    cc = float(cc[2:-2])
-                    kV = int(kV[0:-2])
-                except:
-                    success = False
-                if (success == True):
-                    stats = get_stats(os.path.join(root, fn))
-                    row = {'sample':sample,'x':x,'y':y,'dc':dc,'cc':cc,'kV':kV,'cps':stats['cps'],'meas':stats['meas'],'act':stats['act']}
-                    rows_list.append(row)
+    for entry, info, success in zip(entries, names.to_dict('records'), complete):
+        if (success == True):
+            stats = next(stats_iter)
+            row = {'sample':info['sample'],'x':info['x'],'y':info['y'],'dc':info['dc'],'cc':info['cc'],'kV':int(info['kV']),'cps':stats['cps'],'meas':stats['meas'],'act':stats['act']}
+            rows_list.append(row)
     points_df = pd.DataFrame(rows_list)
     return points_df
 
 
 # In[16]:
 
-def get_xrf_points_new(src_dir,out_dir):
+def get_points_new(fpaths):
+    infos = [spe_names.parse_name(os.path.basename(fpath), scheme='new') for fpath in fpaths]
+    complete = [all(info[field] is not None for field in ['x','y','dc','cc','kV']) for info in infos]
+    stats_list = spe_io.read_stats_batch([fpath for fpath, success in zip(fpaths, complete) if success])
+    stats_iter = iter(stats_list)
+    rows = []
+    for info, success in zip(infos, complete):
+        if (success == False):
+            rows.append(None)
+            continue
+        stats = next(stats_iter)
+        row = {'sample':info['sample'],'x':info['x'],'y':info['y'],'dc':info['dc'],'cc':info['cc'],'kV':info['kV'],'cps':stats['cps'],'meas':stats['meas'],'act':stats['act']}
+        rows.append(row)
+    return rows
+
+
+# In[ ]:
+
+def get_point_new(fpath):
+    return get_points_new([fpath])[0]
+
+
+# Passing index_path (a SQLite file, see file_index) reuses the rows of files unchanged since the last run
+
+# In[ ]:
+
+def get_xrf_points_new(src_dir,out_dir,index_path=None):
     cols = ['sample','x','y','dc','cc','kV']
     rows_list = []
-    for root, dirs, files in os.walk(src_dir):
-        for fn in files:
-            success = True
-            if (fn.find(".spe") != -1):
-                fn_pts = fn.split("!")
-                sample = fn_pts[0]
-                x = fn_pts[9]
-                y = fn_pts[10]
-                dc = fn_pts[12]
-                cc = fn_pts[13]
-                kV = fn_pts[7]
-                try:
-                    x = float(x)
-                    y = float(y)
-                    dc = float(dc)
-                    cc = float(cc)
-                    kV = int(kV)
-                except:
-                    success = False
-                if (success == True):
-                    stats = get_stats(os.path.join(root, fn))
-                    row = {'sample':sample,'x':x,'y':y,'dc':dc,'cc':cc,'kV':kV,'cps':stats['cps'],'meas':stats['meas'],'act':stats['act']}
-                    rows_list.append(row)
+    entries = file_scan.scan(src_dir, ".spe")
+    for entry, row in file_index.indexed_batch(entries, get_points_new, index_path, "depth_extract.points_new", prefix=src_dir):
+        if (row is not None):
+            rows_list.append((entry.path, row))
+    ## indexed_batch yields stored rows first, so the rows are put back in path order ##
+    rows_list = [row for path, row in sorted(rows_list, key=lambda pair: pair[0])]
     points_df = pd.DataFrame(rows_list)
     return points_df
 
@@ -8,7 +8,10 @@
 # In[1]:
 
 import os
+import sys
 import shutil
+sys.path.append(os.path.join(os.path.dirname(os.getcwd()), "spe_common"))
+import file_scan
 
 src = 'C:\\Users\\levay_b\\Work\\XRF_Data\\Users\\367\\U1499A'
 src_dir = os.path.join(src,"")
@@ -23,7 +26,8 @@ def sort_by_energy(src_dir,out_dir,energies):
         if (os.path.isdir(energy_path) == False):
             os.mkdir(energy_path)
 
-    for root, dirs, files in os.walk(src_dir):
+    for entry in file_scan.scan_sorted(src_dir):
+        root, file = os.path.split(entry.path)
         dirname = os.path.split(root)[1]
         run_loc = dirname.find("Run")
         if (run_loc) != -1:
@@ -32,11 +36,9 @@ def sort_by_energy(src_dir,out_dir,energies):
                 energy_loc = dirname.find(energy_str)
                 if (energy_loc) != -1:
                     dest_path = os.path.join(out_dir,energy_str)
-                    for file in files:
-                        orig_file_path = os.path.join(root,file)
-                        new_file_path = os.path.join(dest_path,file)
-                        if (os.path.isfile(new_file_path) == False):
-                            shutil.copy(orig_file_path, dest_path)
+                    new_file_path = os.path.join(dest_path,file)
+                    if (os.path.isfile(new_file_path) == False):
+                        shutil.copy(entry.path, dest_path)
     return None
 
 
@@ -8,25 +8,22 @@
 # In[20]:
 
 import os
+import sys
 import pandas as pd
+sys.path.append(os.path.join(os.path.dirname(os.getcwd()), "spe_common"))
+import spe_io
+import file_scan
 
 
 # In[21]:
 
 def extract_matrix(src_dir, out_dir):
-    for root, dirs, files in os.walk(src_dir):
-        for fname in files:
-            if (fname.find(".csv") != -1):
-                contents = pd.read_csv(os.path.join(root, fname))
-                matrix = contents['ymatrix'].tolist()
-                with open(os.path.join(out_dir, fname.replace(".csv",".spe")),'w') as f:
-                    f.write("$DATA:\n0 2047\n")
-                    for i,val in enumerate(matrix):
-                        if ((i+1) % 10 == 0) | (i == len(matrix)-1):
-                            f.write("{0:.0f}\n".format(val))
-                        else:
-                            f.write("{0:.0f}  ".format(val))
-                        
+    for entry in file_scan.scan(src_dir, ".csv"):
+        fname = os.path.basename(entry.path)
+        contents = pd.read_csv(entry.path)
+        matrix = contents['ymatrix'].tolist()
+        spe_io.write_spe(os.path.join(out_dir, os.path.splitext(fname)[0] + ".spe"), matrix,
+                         per_line=10, fmt="{0:.0f}", sep="  ", range_sep=" ")
     return None
 
 
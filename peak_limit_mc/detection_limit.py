@@ -0,0 +1,188 @@
+
+# coding: utf-8
+
+# # Monte Carlo Detection Limits
+#
+# Estimates the smallest net peak area that is significant above background. A peak window of block_width = int(peak_fwhm / e_channels) channels sits between two reference windows of the same width, each channel holding bg_ave counts. The net area is the peak window sum minus the mean of the two reference sums, and the detection threshold is the quantile (95th by default) of the net area over many repetitions with no peak present.
+#
+# The sum of block_width independent channels is drawn directly: N(w*bg_ave, w*bg_std^2) for Gaussian noise with bg_std = sqrt(bg_ave), and Poisson(w*bg_ave) for Poisson noise. All repetitions are drawn as one (reps, 3) array, in chunks of chunk_size repetitions to bound memory, and the quantile is found with np.partition instead of a full sort.
+#
+# sweep() runs every combination of background, FWHM and channel width, optionally over a process pool.
+#
+# The same quantities also have closed forms (Currie, 1968). With B = block_width * bg_ave counts in each window, the net area has variance sigma0^2 = B + 2B/4 = 1.5B with no peak present, so
+#   critical level   L_C = z(1-alpha) * sigma0
+#   detection limit  L_D = L_C + z(1-beta) * sigma_D
+# where sigma_D = sigma0 for Gaussian noise of fixed width and sigma_D = sqrt(sigma0^2 + L_D) for Poisson noise, which gives a quadratic in L_D. limit_table() evaluates these over full parameter grids, and cross_check() runs the Monte Carlo on a sampled subset of rows to validate them.
+
+# ## Imports
+
+# In[1]:
+
+import itertools
+import multiprocessing as mp
+from statistics import NormalDist
+import numpy as np
+import pandas as pd
+
+
+# ## Window Sums
+
+# In[2]:
+
+def block_width(peak_fwhm, e_channels):
+    return int(peak_fwhm / e_channels)
+
+
+# In[3]:
+
+def draw_window_sums(rng, bg_ave, width, n_reps, noise='gaussian'):
+    if noise == 'gaussian':
+        return rng.normal(width*bg_ave, np.sqrt(width*bg_ave), size=(n_reps, 3))
+    elif noise == 'poisson':
+        return rng.poisson(width*bg_ave, size=(n_reps, 3)).astype(float)
+    raise ValueError("noise must be 'gaussian' or 'poisson', not {!r}".format(noise))
+
+
+# Windows are [ref1, peak, ref2]; as in the original loop, net areas are truncated to whole counts unless truncate=False
+
+# In[4]:
+
+def net_peak_areas(bg_ave, width, reps, noise='gaussian', chunk_size=1000000, seed=None, truncate=True):
+    rng = np.random.default_rng(seed)
+    net_peaks = np.zeros(reps)
+    for start in range(0, reps, chunk_size):
+        stop = min(start + chunk_size, reps)
+        sums = draw_window_sums(rng, bg_ave, width, stop - start, noise)
+        net = sums[:,1] - (sums[:,0] + sums[:,2])/2
+        net_peaks[start:stop] = np.trunc(net) if truncate else net
+    return net_peaks
+
+
+# ## Detection Threshold for One Case
+
+# The k-th smallest net area with k = int(quantile*reps), the same element the original full sort picked
+
+# In[5]:
+
+def upper_quantile(values, quantile):
+    k = min(int(quantile*len(values)), len(values)-1)
+    return np.partition(values, k)[k]
+
+
+# In[6]:
+
+def min_peak_mc(bg_ave, peak_fwhm, e_channels, reps=100000, quantile=0.95, noise='gaussian', chunk_size=1000000, seed=None,
+                truncate=True):
+    width = block_width(peak_fwhm, e_channels)
+    net_peaks = net_peak_areas(bg_ave, width, reps, noise, chunk_size, seed, truncate)
+    return upper_quantile(net_peaks, quantile)
+
+
+# ## Parameter Sweeps
+
+# In[7]:
+
+def sweep_case(case):
+    bg_ave, peak_fwhm, e_channels, reps, quantile, noise, chunk_size, seed, truncate = case
+    width = block_width(peak_fwhm, e_channels)
+    row = {'bg_ave': bg_ave, 'peak_fwhm': peak_fwhm, 'e_channels': e_channels,
+           'block_width': width, 'n_channels': 3*width, 'bg_area': bg_ave*width,
+           'min_peak_exp': 2*np.sqrt(bg_ave*width),
+           'min_peak_model': min_peak_mc(bg_ave, peak_fwhm, e_channels, reps, quantile, noise, chunk_size, seed, truncate)}
+    return row
+
+
+# In[8]:
+
+def run_cases(cases, processes=None):
+    if processes == 1:
+        return [sweep_case(case) for case in cases]
+    with mp.Pool(processes) as pool:
+        return pool.map(sweep_case, cases)
+
+
+# Every combination of bg_vals x fwhm_vals x channel_vals, one row per case. Each case gets its own seed spawned from seed, so results do not depend on processes. processes=1 runs in the calling process.
+
+# In[9]:
+
+def sweep(bg_vals, fwhm_vals, channel_vals, reps=100000, quantile=0.95, noise='gaussian',
+          chunk_size=1000000, seed=None, processes=None):
+    combos = list(itertools.product(bg_vals, fwhm_vals, channel_vals))
+    seeds = np.random.SeedSequence(seed).spawn(len(combos))
+    cases = [(bg, fwhm, ch, reps, quantile, noise, chunk_size, s, True) for (bg, fwhm, ch), s in zip(combos, seeds)]
+    rows = run_cases(cases, processes)
+    results = pd.DataFrame(rows)
+    return results
+
+
+# ## Closed-Form Limits
+
+# In[10]:
+
+def z_value(prob):
+    return NormalDist().inv_cdf(prob)
+
+
+# In[11]:
+
+def net_area_std(bg_area):
+    return np.sqrt(1.5 * np.asarray(bg_area, dtype=float))
+
+
+# In[12]:
+
+def critical_level(bg_area, alpha=0.05):
+    return z_value(1.0 - alpha) * net_area_std(bg_area)
+
+
+# In[13]:
+
+def detection_limit(bg_area, alpha=0.05, beta=0.05, noise='poisson'):
+    sigma0 = net_area_std(bg_area)
+    L_C = z_value(1.0 - alpha) * sigma0
+    z_b = z_value(1.0 - beta)
+    if noise == 'gaussian':
+        return L_C + z_b * sigma0
+    elif noise == 'poisson':
+        ## (L_D - L_C)^2 = z_b^2 * (sigma0^2 + L_D) ##
+        b = 2.0*L_C + z_b**2
+        c = L_C**2 - (z_b**2) * (sigma0**2)
+        return (b + np.sqrt(b**2 - 4.0*c)) / 2.0
+    raise ValueError("noise must be 'gaussian' or 'poisson', not {!r}".format(noise))
+
+
+# One row per combination of bg_vals x fwhm_vals x channel_vals, with the same parameter columns as sweep()
+
+# In[14]:
+
+def limit_table(bg_vals, fwhm_vals, channel_vals, alpha=0.05, beta=0.05, noise='poisson'):
+    bg, fwhm, ch = [arr.ravel() for arr in np.meshgrid(bg_vals, fwhm_vals, channel_vals, indexing='ij')]
+    width = np.floor(fwhm / ch).astype(int)
+    bg_area = bg * width
+    results = pd.DataFrame({'bg_ave': bg, 'peak_fwhm': fwhm, 'e_channels': ch,
+                            'block_width': width, 'n_channels': 3*width, 'bg_area': bg_area,
+                            'L_C': critical_level(bg_area, alpha),
+                            'L_D': detection_limit(bg_area, alpha, beta, noise)})
+    return results
+
+
+# ## Monte Carlo Cross-Check
+
+# Runs the Monte Carlo for n_samples rows drawn at random from a limit_table() and compares its (1-alpha) quantile with L_C. The Monte Carlo net areas are not truncated here, since L_C is continuous and truncating would bias the quantile low by up to one count. Rows with block_width 0 (FWHM narrower than a channel, so L_C = 0) are left out. diff = mc_L_C - L_C in counts and rel_diff = diff / L_C. With Poisson noise the net area only takes half-integer values, so diff is within about half a count of zero plus sampling noise, which is a few percent of L_C for small backgrounds.
+
+# In[15]:
+
+def cross_check(table, n_samples=10, alpha=0.05, reps=100000, noise='poisson', chunk_size=1000000,
+                seed=None, processes=None):
+    table = table[table['block_width'] > 0]
+    rng = np.random.default_rng(seed)
+    picks = rng.choice(len(table), size=min(n_samples, len(table)), replace=False)
+    sample = table.iloc[np.sort(picks)].reset_index(drop=True)
+    seeds = np.random.SeedSequence(seed).spawn(len(sample))
+    cases = [(row.bg_ave, row.peak_fwhm, row.e_channels, reps, 1.0-alpha, noise, chunk_size, s, False)
+             for row, s in zip(sample.itertuples(), seeds)]
+    rows = run_cases(cases, processes)
+    sample['mc_L_C'] = [row['min_peak_model'] for row in rows]
+    sample['diff'] = sample['mc_L_C'] - sample['L_C']
+    sample['rel_diff'] = sample['diff'] / sample['L_C']
+    return sample
@@ -0,0 +1,170 @@
+
+# coding: utf-8
+
+# # Incremental File Index
+#
+# A SQLite file that remembers, for each file a tool has processed, its size, modification time and the result the tool parsed from it (stored as JSON). On the next run, files whose size and mtime are unchanged take their result from the index, and only new or changed files are read again.
+#
+# Each tool stores its results under its own name, so several tools can share one index file:
+#
+#     for entry, data in file_index.indexed(file_scan.scan(src_dir, ".spe"), parse, index_path, "depth_extract", prefix=src_dir):
+#         ...
+#
+# parse(path) must return something json can store (dicts, lists, str, int, float or None). Results are also stored with the parser's version number; a tool bumps the version it passes whenever its parse function changes what it returns, so older results are parsed again. With index_path=None every file is parsed, as before. indexed_batch() does the same with a function that parses a list of files at once, for tools that read files on a thread pool.
+
+# ## Imports
+
+# In[1]:
+
+import os
+import json
+import sqlite3
+
+
+# ## Index File
+
+# In[2]:
+
+def open_index(index_path):
+    conn = sqlite3.connect(index_path)
+    conn.execute("CREATE TABLE IF NOT EXISTS files ("
+                 "tool TEXT NOT NULL, path TEXT NOT NULL, size INTEGER, mtime REAL, version INTEGER DEFAULT 0, data TEXT, "
+                 "PRIMARY KEY (tool, path))")
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(files)")]
+    if 'version' not in columns:
+        conn.execute("ALTER TABLE files ADD COLUMN version INTEGER DEFAULT 0")
+    conn.commit()
+    return conn
+
+
+# Returns (lower, upper) such that lower <= path < upper holds exactly for the paths inside folder prefix
+
+# In[3]:
+
+def path_range(prefix):
+    lower = os.path.join(prefix, "")
+    upper = lower[:-1] + chr(ord(lower[-1]) + 1)
+    return lower, upper
+
+
+# Returns {path: (size, mtime, parser version, data as JSON text)} for every file the tool has stored, or only those inside folder prefix
+
+# In[4]:
+
+def known_files(conn, tool, prefix=None):
+    if prefix is None:
+        rows = conn.execute("SELECT path, size, mtime, version, data FROM files WHERE tool = ?", (tool,))
+    else:
+        rows = conn.execute("SELECT path, size, mtime, version, data FROM files WHERE tool = ? AND path >= ? AND path < ?",
+                            (tool,) + path_range(prefix))
+    return {path: (size, mtime, version, data) for path, size, mtime, version, data in rows}
+
+
+# In[5]:
+
+def is_current(known, entry, version=0):
+    if entry.path not in known:
+        return False
+    size, mtime, stored_version, _ = known[entry.path]
+    return (size == entry.size) and (mtime == entry.mtime) and (stored_version == version)
+
+
+# In[6]:
+
+def stored(known, entry):
+    return json.loads(known[entry.path][3])
+
+
+# In[7]:
+
+def store(conn, tool, entries, results, version=0):
+    conn.executemany("INSERT OR REPLACE INTO files (tool, path, size, mtime, version, data) VALUES (?, ?, ?, ?, ?, ?)",
+                     [(tool, entry.path, entry.size, entry.mtime, version, json.dumps(data))
+                      for entry, data in zip(entries, results)])
+    conn.commit()
+    return None
+
+
+# Removes the stored files (inside folder prefix, if given) that are not in seen_paths, i.e. files deleted since the last full scan
+
+# In[8]:
+
+def forget_missing(conn, tool, seen_paths, prefix=None):
+    known = known_files(conn, tool, prefix)
+    missing = [(tool, path) for path in known if path not in seen_paths]
+    conn.executemany("DELETE FROM files WHERE tool = ? AND path = ?", missing)
+    conn.commit()
+    return len(missing)
+
+
+# ## Main Function to Call
+
+# Yields (entry, parse result) for each file_scan entry, parsing only new or changed files. New results are written to the index every batch_size files and at the end. prefix is the folder that was scanned: only the files stored under it are loaded, and once every entry has been yielded the stored files under it that were not seen are removed from the index. version is the version of the parse function: results stored by another version are parsed again.
+
+# In[9]:
+
+def indexed(entries, parse, index_path, tool, batch_size=1000, prefix=None, version=0):
+    if index_path is None:
+        for entry in entries:
+            yield entry, parse(entry.path)
+        return
+    conn = open_index(index_path)
+    try:
+        known = known_files(conn, tool, prefix)
+        seen_paths = set()
+        new_entries = []
+        new_results = []
+        for entry in entries:
+            seen_paths.add(entry.path)
+            if is_current(known, entry, version):
+                yield entry, stored(known, entry)
+                continue
+            data = parse(entry.path)
+            new_entries.append(entry)
+            new_results.append(data)
+            if len(new_entries) == batch_size:
+                store(conn, tool, new_entries, new_results, version)
+                new_entries = []
+                new_results = []
+            yield entry, data
+        store(conn, tool, new_entries, new_results, version)
+        if prefix is not None:
+            forget_missing(conn, tool, seen_paths, prefix)
+    finally:
+        conn.close()
+
+
+# Same as indexed(), but parse_batch(paths) parses a list of files at once and returns a list of results. New or changed files are collected and parsed batch_size at a time; files taken from the index are yielded as they come, so the order differs from entries.
+
+# In[10]:
+
+def indexed_batch(entries, parse_batch, index_path, tool, batch_size=1000, prefix=None, version=0):
+    conn = None if (index_path is None) else open_index(index_path)
+    try:
+        known = {} if (conn is None) else known_files(conn, tool, prefix)
+        seen_paths = set()
+        pending = []
+        for entry in entries:
+            seen_paths.add(entry.path)
+            if is_current(known, entry, version):
+                yield entry, stored(known, entry)
+                continue
+            pending.append(entry)
+            if len(pending) == batch_size:
+                results = parse_batch([new_entry.path for new_entry in pending])
+                if conn is not None:
+                    store(conn, tool, pending, results, version)
+                for new_entry, data in zip(pending, results):
+                    yield new_entry, data
+                pending = []
+        if len(pending) > 0:
+            results = parse_batch([new_entry.path for new_entry in pending])
+            if conn is not None:
+                store(conn, tool, pending, results, version)
+            for new_entry, data in zip(pending, results):
+                yield new_entry, data
+        if (conn is not None) and (prefix is not None):
+            forget_missing(conn, tool, seen_paths, prefix)
+    finally:
+        if conn is not None:
+            conn.close()
@@ -0,0 +1,94 @@
+
+# coding: utf-8
+
+# # Parallel Directory Scanning
+#
+# Shared by the tools that walk an archive folder (count_spe, depth_extract, file_reorg, standards_by_date, matrix_files, xmso_processing, axml_processing, spe_to_csv). Tools in the sibling folders import it with:
+#
+#     sys.path.append(os.path.join(os.path.dirname(os.getcwd()), "spe_common"))
+#     import file_scan
+#
+# scan() lists directories with os.scandir on a pool of threads, one directory per task, so many directory listings are in flight at once on a network share. It yields an Entry(path, size, mtime) for every file below src_dir whose name ends with one of the extensions (case-insensitive), in a single pass. Files are yielded as their directories are listed, so the order is not fixed; scan_sorted() returns them sorted by path instead, so that output files come out in the same order on every run. Directories that cannot be read are skipped, as os.walk does.
+
+# ## Imports
+
+# In[1]:
+
+import os
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+
+# ## Entries
+
+# In[2]:
+
+Entry = namedtuple('Entry', ['path', 'size', 'mtime'])
+
+
+# In[3]:
+
+def matches(name, extensions):
+    if extensions is None:
+        return True
+    return name.lower().endswith(extensions)
+
+
+# Returns (matching file entries, subdirectory paths) for one directory
+
+# In[4]:
+
+def scan_dir(dir_path, extensions):
+    files = []
+    subdirs = []
+    try:
+        with os.scandir(dir_path) as it:
+            for item in it:
+                try:
+                    if item.is_dir(follow_symlinks=False):
+                        subdirs.append(item.path)
+                    elif matches(item.name, extensions):
+                        info = item.stat()
+                        files.append(Entry(item.path, info.st_size, info.st_mtime))
+                except OSError:
+                    pass
+    except OSError:
+        pass
+    return files, subdirs
+
+
+# ## Main Function to Call
+
+# extensions is a string or list such as ".spe" or [".spe", ".csv"]; None yields every file
+
+# In[5]:
+
+def scan(src_dir, extensions=None, max_workers=16):
+    if isinstance(extensions, str):
+        extensions = (extensions,)
+    if extensions is not None:
+        extensions = tuple(ext.lower() for ext in extensions)
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        pending = {pool.submit(scan_dir, src_dir, extensions)}
+        while len(pending) > 0:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                files, subdirs = future.result()
+                for subdir in subdirs:
+                    pending.add(pool.submit(scan_dir, subdir, extensions))
+                for entry in files:
+                    yield entry
+
+
+# In[6]:
+
+def scan_paths(src_dir, extensions=None, max_workers=16):
+    return [entry.path for entry in scan(src_dir, extensions, max_workers)]
+
+
+# Returns the entries as a list sorted by path, for tools whose output follows the order of the files
+
+# In[7]:
+
+def scan_sorted(src_dir, extensions=None, max_workers=16):
+    return sorted(scan(src_dir, extensions, max_workers), key=lambda entry: entry.path)
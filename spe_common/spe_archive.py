@@ -0,0 +1,150 @@
+
+# coding: utf-8
+
+# # Columnar Spectrum Archive
+#
+# Packs many spectra into one folder instead of one wide CSV:
+#
+#     archive.json   {"n_channels": 2048, "n_spectra": N, "dtype": "int32", "columns": [...], "meta_bytes": size of metadata.csv}
+#     counts.i32     raw int32 counts, N x n_channels, one spectrum per row
+#     metadata.csv   one row per spectrum, in the same order as counts.i32
+#
+# Spectra are appended in batches: the counts are written to the end of counts.i32, the metadata rows to the end of metadata.csv, and n_spectra and meta_bytes in archive.json are updated last, so anything past them left by an interrupted append is ignored and overwritten by the next one. update_spectra() overwrites rows already in the archive, for spectra whose source file has changed. open_archive() memory-maps the counts, so a whole expedition loads without reading the data.
+
+# ## Imports
+
+# In[1]:
+
+import os
+import json
+import numpy as np
+import pandas as pd
+
+
+# ## Archive Files
+
+# In[2]:
+
+def archive_paths(archive_dir):
+    paths = {'info': os.path.join(archive_dir, "archive.json"),
+             'counts': os.path.join(archive_dir, "counts.i32"),
+             'meta': os.path.join(archive_dir, "metadata.csv")}
+    return paths
+
+
+# In[3]:
+
+def read_info(archive_dir):
+    with open(archive_paths(archive_dir)['info']) as f:
+        return json.load(f)
+
+
+# In[4]:
+
+def write_info(archive_dir, info):
+    path = archive_paths(archive_dir)['info']
+    with open(path + ".tmp", 'w') as f:
+        json.dump(info, f)
+    os.replace(path + ".tmp", path)
+    return None
+
+
+# In[5]:
+
+def create_archive(archive_dir, n_channels=2048):
+    os.makedirs(archive_dir, exist_ok=True)
+    paths = archive_paths(archive_dir)
+    if os.path.isfile(paths['info']):
+        return read_info(archive_dir)
+    open(paths['counts'], 'wb').close()
+    open(paths['meta'], 'w').close()
+    info = {'n_channels': n_channels, 'n_spectra': 0, 'dtype': 'int32', 'columns': [], 'meta_bytes': 0}
+    write_info(archive_dir, info)
+    return info
+
+
+# ## Appending
+
+# counts is (n, n_channels); meta_rows is a list of n dicts (or a DataFrame). The first append fixes the metadata columns.
+
+# In[6]:
+
+def append_spectra(archive_dir, counts, meta_rows):
+    info = read_info(archive_dir)
+    paths = archive_paths(archive_dir)
+    counts = np.ascontiguousarray(counts, dtype=np.int32).reshape(-1, info['n_channels'])
+    meta_df = pd.DataFrame(meta_rows)
+    if len(meta_df) != len(counts):
+        raise ValueError("got {:d} spectra but {:d} metadata rows".format(len(counts), len(meta_df)))
+
+    n_old = info['n_spectra']
+    with open(paths['counts'], 'r+b') as f:
+        f.seek(n_old * info['n_channels'] * 4)
+        f.write(counts.tobytes())
+        f.truncate()
+
+    if n_old == 0:
+        info['columns'] = [str(col) for col in meta_df.columns]
+    meta_text = meta_df.to_csv(header=(n_old == 0), index=False, columns=info['columns'], lineterminator="\n")
+    meta_bytes = meta_text.encode('utf-8')
+    with open(paths['meta'], 'r+b') as f:
+        f.seek(info['meta_bytes'])
+        f.write(meta_bytes)
+        f.truncate()
+
+    info['n_spectra'] = n_old + len(counts)
+    info['meta_bytes'] = info['meta_bytes'] + len(meta_bytes)
+    write_info(archive_dir, info)
+    return info['n_spectra']
+
+
+# Overwrites existing rows in place: counts[row_indices] and the matching metadata lines. The metadata file is rewritten with the other lines unchanged.
+
+# In[7]:
+
+def update_spectra(archive_dir, row_indices, counts, meta_rows):
+    info = read_info(archive_dir)
+    paths = archive_paths(archive_dir)
+    counts = np.ascontiguousarray(counts, dtype=np.int32).reshape(-1, info['n_channels'])
+    meta_df = pd.DataFrame(meta_rows)
+    if (len(meta_df) != len(counts)) or (len(row_indices) != len(counts)):
+        raise ValueError("got {:d} row indices, {:d} spectra and {:d} metadata rows".format(len(row_indices), len(counts), len(meta_df)))
+    for row in row_indices:
+        if (row < 0) or (row >= info['n_spectra']):
+            raise IndexError("row {:d} is not in an archive of {:d} spectra".format(row, info['n_spectra']))
+
+    stored = np.memmap(paths['counts'], dtype=np.int32, mode='r+', shape=(info['n_spectra'], info['n_channels']))
+    stored[list(row_indices)] = counts
+    stored.flush()
+    del stored
+
+    with open(paths['meta'], 'rb') as f:
+        lines = f.read(info['meta_bytes']).splitlines(keepends=True)
+    new_lines = meta_df.to_csv(header=False, index=False, columns=info['columns'], lineterminator="\n").encode('utf-8').splitlines(keepends=True)
+    for row, line in zip(row_indices, new_lines):
+        lines[row + 1] = line
+    meta_bytes = b"".join(lines)
+    with open(paths['meta'] + ".tmp", 'wb') as f:
+        f.write(meta_bytes)
+    os.replace(paths['meta'] + ".tmp", paths['meta'])
+
+    info['meta_bytes'] = len(meta_bytes)
+    write_info(archive_dir, info)
+    return info['n_spectra']
+
+
+# ## Loading
+
+# Returns (counts, metadata): counts is an (n_spectra, n_channels) int32 memmap, read-only unless mode='r+'
+
+# In[8]:
+
+def open_archive(archive_dir, mode='r'):
+    info = read_info(archive_dir)
+    paths = archive_paths(archive_dir)
+    shape = (info['n_spectra'], info['n_channels'])
+    if info['n_spectra'] == 0:
+        return np.zeros(shape, dtype=np.int32), pd.DataFrame()
+    counts = np.memmap(paths['counts'], dtype=np.int32, mode=mode, shape=shape)
+    metadata = pd.read_csv(paths['meta'], nrows=info['n_spectra'])
+    return counts, metadata
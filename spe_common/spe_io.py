@@ -0,0 +1,183 @@
+
+# coding: utf-8
+
+# # Reading and Writing SPE Files
+#
+# Shared by the tools that read or write .spe spectra (spe_to_csv, depth_extract, matrix_files, xmso_processing). Tools in the sibling folders import it with:
+#
+#     sys.path.append(os.path.join(os.path.dirname(os.getcwd()), "spe_common"))
+#     import spe_io
+#
+# An SPE file is a series of sections, each a "$NAME:" line followed by its value lines. The "$DATA:" section holds the channel range ("0 2047") and then the counts, several per line:
+#
+#     $MEAS_TIM:
+#     300 312
+#     $TotalCPS:
+#     5120
+#     $DATA:
+#     0 2047
+#     0  0  3  12 ...
+#
+# Header-only reads (read_header, read_stats) stop at "$DATA:" without reading the counts. Files are read and written as latin-1, so every byte of a header (e.g. a non-ASCII sample description) maps to one character the same way in every reader, and survives a read and write unchanged. The counts are parsed in one bulk numeric read into an int32 array. Files holding non-integer counts (e.g. simulated spectra) are read as floats and rounded.
+
+# ## Imports
+
+# In[1]:
+
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+
+# ## Header Sections
+
+# Returns {section name without "$" and ":": [value lines]}
+
+# In[2]:
+
+def parse_sections(lines):
+    sections = {}
+    current = None
+    for line in lines:
+        line = line.strip()
+        if line.startswith("$") and line.endswith(":"):
+            current = line[1:-1]
+            sections[current] = []
+        elif (current is not None) and (line != ""):
+            sections[current].append(line)
+    return sections
+
+
+# In[3]:
+
+def header_value(header, name, index=0, dtype=int, default=0):
+    try:
+        return dtype(header[name][0].split()[index])
+    except (KeyError, IndexError, ValueError):
+        return default
+
+
+# ## Reading
+
+# Reads the header sections only: the file is read in binary chunks of chunk_size bytes and reading stops at "$DATA:", so the data block is never read
+
+# In[4]:
+
+def read_header(path, chunk_size=4096):
+    marker = b"$DATA:"
+    head = bytearray()
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if len(chunk) == 0:
+                break
+            start = max(0, len(head) - len(marker) + 1)
+            head += chunk
+            end = head.find(marker, start)
+            if end != -1:
+                del head[end:]
+                break
+    return parse_sections(head.decode('latin-1').splitlines())
+
+
+# Returns {'cps': $TotalCPS, 'meas': measured and 'act': actual time from $MEAS_TIM}, 0 where missing
+
+# In[5]:
+
+def header_stats(header):
+    stats = {'cps': header_value(header, "TotalCPS"),
+             'meas': header_value(header, "MEAS_TIM", 0),
+             'act': header_value(header, "MEAS_TIM", 1)}
+    return stats
+
+
+# In[6]:
+
+def read_stats(path, chunk_size=4096):
+    return header_stats(read_header(path, chunk_size))
+
+
+# Reads the header stats of many files on a pool of threads, returning them in the order of paths
+
+# In[7]:
+
+def read_stats_batch(paths, max_workers=16, chunk_size=4096):
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        return list(pool.map(lambda path: read_stats(path, chunk_size), paths))
+
+
+# In[8]:
+
+## Missing values at the end of a short block are left as zero ##
+def parse_counts(text, n_channels):
+    if (text.find(".") == -1) and (text.find("e") == -1) and (text.find("E") == -1):
+        values = np.fromstring(text, dtype=np.int64, sep=" ")
+    else:
+        values = np.rint(np.array(text.split(), dtype=float))
+    counts = np.zeros(n_channels, dtype=np.int32)
+    n = min(len(values), n_channels)
+    counts[:n] = values[:n]
+    return counts
+
+
+# Returns {'header': sections before $DATA:, 'first': first channel, 'last': last channel, 'counts': int32 array, 'trailer': sections after the counts}
+
+# In[9]:
+
+def read_spe(path):
+    with open(path, encoding='latin-1') as f:
+        text = f.read()
+    k = text.find("$DATA:")
+    if k == -1:
+        return {'header': parse_sections(text.splitlines()), 'first': 0, 'last': -1,
+                'counts': np.zeros(0, dtype=np.int32), 'trailer': {}}
+    header = parse_sections(text[:k].splitlines())
+    data_text = text[k+len("$DATA:"):]
+    end = data_text.find("$")
+    trailer = {} if end == -1 else parse_sections(data_text[end:].splitlines())
+    if end != -1:
+        data_text = data_text[:end]
+    range_line, _, values = data_text.strip().partition("\n")
+    first, last = [int(val) for val in range_line.split()[:2]]
+    counts = parse_counts(values, last - first + 1)
+    spe = {'header': header, 'first': first, 'last': last, 'counts': counts, 'trailer': trailer}
+    return spe
+
+
+# In[10]:
+
+def fit_channels(counts, n_channels):
+    fitted = np.zeros(n_channels, dtype=counts.dtype)
+    n = min(len(counts), n_channels)
+    fitted[:n] = counts[:n]
+    return fitted
+
+
+# Returns the counts; with n_channels, zero-padded or cut to exactly n_channels values
+
+# In[11]:
+
+def read_counts(path, n_channels=None):
+    counts = read_spe(path)['counts']
+    if n_channels is not None:
+        counts = fit_channels(counts, n_channels)
+    return counts
+
+
+# ## Writing
+
+# Writes header sections (if any), then "$DATA:", the channel range and the values, per_line values to a line. fmt formats each value and sep joins values on a line, so for example matrix_files writes fmt="{0:.0f}", sep="  " and xmso_processing passes the counts as strings with fmt="{:s}".
+
+# In[12]:
+
+def write_spe(path, values, per_line=10, fmt="{0:.0f}", sep="  ", range_sep=" ", header=None):
+    with open(path, 'w', encoding='latin-1') as f:
+        if header is not None:
+            for name in header:
+                f.write("${:s}:\n".format(name))
+                for line in header[name]:
+                    f.write("{}\n".format(line))
+        f.write("$DATA:\n")
+        f.write("0{:s}{:d}\n".format(range_sep, len(values)-1))
+        for start in range(0, len(values), per_line):
+            f.write(sep.join([fmt.format(val) for val in values[start:start+per_line]]) + "\n")
+    return None
@@ -0,0 +1,114 @@
+
+# coding: utf-8
+
+# # Parsing Metadata from SPE File Names
+#
+# Shared by count_spe, depth_extract and spe_to_csv. Two naming schemes are in the archive:
+#
+#     old: space-delimited, e.g. "U1489A-1H-4A  X 40.0mm  Y 5.0mm  DC 10.0mm  CC 1.0mm  6s  9kV 250uA No-Filter.spe"
+#          fields are found by their labels (X, Y, DC, CC in mm, and kV) wherever they appear
+#     new: "!"-delimited, with sample in field 0, kV in field 7, x in 9, y in 10, dc in 12 and cc in 13
+#
+# Each scheme is one precompiled pattern with a named group per field; fields that are not present are left empty (None, or NaN in the vectorised form). The hole is the first "U" followed by 4-5 letters or digits anywhere in the name. Names with at least 13 "!" are taken as the new scheme, all others as the old.
+#
+# parse_name() parses one name into a dict. parse_names() parses a whole list at once, converting the columns in bulk, and returns a DataFrame with typed columns.
+
+# ## Imports
+
+# In[1]:
+
+import re
+import pandas as pd
+
+
+# ## Patterns
+
+# Each old-scheme field is an optional lookahead from the start of the name, so labels can come in any order. The lookaheads skip ahead to the label's first letter ([^X]*) and the hole to the next "U" rather than stepping one character at a time, which keeps a full match to a few microseconds.
+
+# In[2]:
+
+number = r'[-+]?\d*\.?\d+'
+
+def first(text, c):
+    return r'(?=[^{c}]*(?:{c}[^{c}]*)*?{t})?'.format(c=c, t=text)
+
+def labelled(label, group):
+    return first(r'{l}\s*(?P<{g}>{n})\s*mm'.format(l=label, g=group, n=number), label[0])
+
+hole_field = first(r'(?P<hole>U[a-zA-Z0-9]{4,5})', 'U')
+
+patterns = {
+    'old': re.compile(r'^(?=(?P<sample>[^\s!]+))' + hole_field +
+                      labelled('X', 'x') + labelled('Y', 'y') + labelled('DC', 'dc') + labelled('CC', 'cc') +
+                      r'(?=.*?(?P<kV>\d{1,2})\s*kV)?'),
+    'new': re.compile(r'^' + hole_field +
+                      r'(?P<sample>[^!]*)!(?:[^!]*!){6}(?P<kV>[^!]*)![^!]*!(?P<x>[^!]*)!(?P<y>[^!]*)![^!]*!(?P<dc>[^!]*)!(?P<cc>[^!]*)(?:!|$)'),
+}
+
+fields = ['sample', 'hole', 'kV', 'x', 'y', 'dc', 'cc']
+float_fields = ['x', 'y', 'dc', 'cc']
+
+
+# ## Single Names
+
+# In[3]:
+
+def detect_scheme(fname):
+    return 'new' if fname.count("!") >= 13 else 'old'
+
+
+# In[4]:
+
+def to_number(text, dtype):
+    try:
+        return dtype(text)
+    except (TypeError, ValueError):
+        return None
+
+
+# Returns {'scheme', 'sample', 'hole', 'kV', 'x', 'y', 'dc', 'cc'}, with None for any field not found
+
+# In[5]:
+
+def parse_name(fname, scheme=None):
+    scheme = detect_scheme(fname) if scheme is None else scheme
+    info = dict.fromkeys(fields)
+    info['scheme'] = scheme
+    match = patterns[scheme].match(fname)
+    if match is None:
+        return info
+    groups = match.groupdict()
+    info['sample'] = groups['sample']
+    info['hole'] = groups['hole']
+    info['kV'] = to_number(groups['kV'], int)
+    for field in float_fields:
+        info[field] = to_number(groups[field], float)
+    return info
+
+
+# ## Many Names at Once
+
+# Returns a DataFrame with columns name, scheme and the fields, in the order of names. kV is a nullable integer column, and x, y, dc and cc are floats (NaN where not found).
+
+# In[6]:
+
+def parse_names(names, scheme=None):
+    names = list(names)
+    if scheme is None:
+        schemes = [detect_scheme(name) for name in names]
+    else:
+        schemes = [scheme] * len(names)
+    empty = dict.fromkeys(fields)
+    rows = []
+    for name, key in zip(names, schemes):
+        match = patterns[key].match(name)
+        rows.append(empty if match is None else match.groupdict())
+    parsed = pd.DataFrame(rows, columns=fields)
+    parsed.insert(0, 'scheme', schemes)
+    parsed.insert(0, 'name', names)
+    ## a kV such as "9.5" is not found, as in parse_name, rather than failing the cast ##
+    kV = pd.to_numeric(parsed['kV'], errors='coerce')
+    parsed['kV'] = kV.where(kV == kV.round()).astype('Int64')
+    for field in float_fields:
+        parsed[field] = pd.to_numeric(parsed[field], errors='coerce')
+    return parsed
@@ -7,8 +7,15 @@
 
 import os
 import re
+import sys
 import numpy as np
 import pandas as pd
+sys.path.append(os.path.join(os.path.dirname(os.getcwd()), "spe_common"))
+import spe_io
+import spe_archive
+import file_scan
+import file_index
+import spe_names
 
 
 # In[2]:
@@ -25,36 +32,114 @@ print(out_dir)
 def get_spe_data(src_dir, out_dir):
     channels = np.arange(2048)
     maxE = 0.02*2048
-    energies = np.arange(0.0, maxE, 0.02, dtype=np.float)
-    spe_df = pd.DataFrame(data={'channels':channels, 'keV':energies})
+    energies = np.arange(0.0, maxE, 0.02, dtype=float)
+    columns = {'channels':channels, 'keV':energies}
     
-    counts = np.zeros(2048)
-    for root, dirs, files in os.walk(src_dir):
-        for fname in files:
-            if (fname.find(".spe") != -1):
-                valCt = 0
-                dataFlag = False
-                channelFlag = False
-                with open(os.path.join(root, fname)) as f:
-                    lines = f.readlines()
-                for line in lines:
-                    vals = line.strip().split()
-                    if (len(vals) == 1):
-                        if (vals[0] == "$DATA:"):
-                            dataFlag = True
-                    if (len(vals) >= 2):
-                        if (vals[0] == "0") & (vals[1] == "2047"):
-                            channelFlag = True
-                        elif (dataFlag == True) & (channelFlag == True):
-                            for val in vals:
-                                counts[valCt] = val
-                                valCt = valCt + 1
-                spe_df[fname] = counts
+    for entry in file_scan.scan_sorted(src_dir, ".spe"):
+        fname = os.path.basename(entry.path)
+        columns[fname] = spe_io.read_counts(entry.path, 2048)
+    spe_df = pd.DataFrame(data=columns)
     return spe_df
 
 
+# ## Writing to a Spectrum Archive
+
+# Appends every .spe file under src_dir that is not already in the archive to the columnar archive in archive_dir (see spe_archive), batch_size spectra at a time. Position and kV are read from the file name in either naming scheme (see spe_names) and left blank where not found.
+
 # In[4]:
 
+def name_metadata(fname):
+    info = spe_names.parse_name(fname)
+    meta = {}
+    for field in ['kV', 'x', 'y', 'dc', 'cc']:
+        meta[field] = np.nan if (info[field] is None) else info[field]
+    return meta
+
+
+# In[5]:
+
+def read_archive_row(fpath, n_channels):
+    fname = os.path.basename(fpath)
+    spe = spe_io.read_spe(fpath)
+    row = {'filename':fname, 'path':fpath}
+    row.update(name_metadata(fname))
+    row.update(spe_io.header_stats(spe['header']))
+    spec = spe_io.fit_channels(spe['counts'], n_channels)
+    return spec, row
+
+
+# Files already in the archive are found by their source path (the "path" column). Without index_path they are skipped. Passing index_path (a SQLite file, see file_index) also checks their size and mtime, with the rows of each archive_dir kept apart in the index: files changed since they were archived are read again and overwrite their existing row, and files archived before the index was used are recorded in it as they are. The index records the archive row of each file.
+
+# In[6]:
+
+def spe_to_archive(src_dir, archive_dir, n_channels=2048, batch_size=1000, index_path=None):
+    spe_archive.create_archive(archive_dir, n_channels)
+    _, metadata = spe_archive.open_archive(archive_dir)
+    done = dict(zip(metadata['path'], range(len(metadata)))) if ('path' in metadata) else {}
+    ## one index file can serve several archives, so each archive keeps its own rows ##
+    tool = "spe_to_archive:" + os.path.abspath(archive_dir)
+    conn = None
+    known = {}
+    if index_path is not None:
+        conn = file_index.open_index(index_path)
+        known = file_index.known_files(conn, tool, src_dir)
+    
+    def write_batch(entries, counts, rows, row_indices):
+        new = [k for k in range(len(rows)) if row_indices[k] is None]
+        changed = [k for k in range(len(rows)) if row_indices[k] is not None]
+        if len(changed) > 0:
+            spe_archive.update_spectra(archive_dir, [row_indices[k] for k in changed],
+                                       np.array([counts[k] for k in changed]), [rows[k] for k in changed])
+        if len(new) > 0:
+            n_total = spe_archive.append_spectra(archive_dir, np.array([counts[k] for k in new]), [rows[k] for k in new])
+            first = n_total - len(new)
+            for j, k in enumerate(new):
+                row_indices[k] = first + j
+                done[entries[k].path] = first + j
+        if conn is not None:
+            file_index.store(conn, tool, entries, [{'row':row} for row in row_indices])
+    
+    entries = []
+    counts = []
+    rows = []
+    row_indices = []
+    recorded = []
+    seen_paths = set()
+    for entry in file_scan.scan_sorted(src_dir, ".spe"):
+        seen_paths.add(entry.path)
+        row_index = done.get(entry.path)
+        if conn is None:
+            if row_index is not None:
+                continue
+        elif file_index.is_current(known, entry) and (row_index is not None):
+            continue
+        elif (row_index is not None) and (entry.path not in known):
+            recorded.append(entry)
+            continue
+        spec, row = read_archive_row(entry.path, n_channels)
+        entries.append(entry)
+        counts.append(spec)
+        rows.append(row)
+        row_indices.append(row_index)
+        if len(rows) == batch_size:
+            write_batch(entries, counts, rows, row_indices)
+            entries = []
+            counts = []
+            rows = []
+            row_indices = []
+    if len(rows) > 0:
+        write_batch(entries, counts, rows, row_indices)
+    if conn is not None:
+        file_index.store(conn, tool, recorded, [{'row':done[entry.path]} for entry in recorded])
+        file_index.forget_missing(conn, tool, seen_paths, src_dir)
+        conn.close()
+    return spe_archive.open_archive(archive_dir)
+
+
+# ## Running the Program
+
+# In[7]:
+
 spe_df = get_spe_data(src_dir, out_dir)
 spe_df.to_csv(os.path.join(out_dir,"data.csv"),index=False)
 spe_df
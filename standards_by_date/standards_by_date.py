@@ -6,7 +6,10 @@
 # In[1]:
 
 import os
+import sys
 import shutil
+sys.path.append(os.path.join(os.path.dirname(os.getcwd()), "spe_common"))
+import file_scan
 
 
 # In[2]:
@@ -20,17 +23,15 @@ out_dir = os.path.join(os.getcwd(),"out")
 # In[3]:
 
 def sort_add_dates(src_dir,out_dir):
-    for root, dirs, files in os.walk(src_dir):
+    dest_path = os.path.join(out_dir,"")
+    for entry in file_scan.scan_sorted(src_dir, ".spe"):
+        root, file = os.path.split(entry.path)
         dirname = os.path.split(root)[1]
-        dest_path = os.path.join(out_dir,"")
-        for file in files:
-            spe_loc = file.find(".spe")
-            if (spe_loc != -1):
-                orig_file_path = os.path.join(root,file)
-                file_mod = file.replace(",",".").replace("_","-").replace(".spe"," "+dirname+".spe")
-                new_file_path = os.path.join(dest_path,file_mod)
-                if (os.path.isfile(new_file_path) == False):
-                    shutil.copyfile(orig_file_path, new_file_path)
+        name, ext = os.path.splitext(file)
+        file_mod = name.replace(",",".").replace("_","-") + " " + dirname + ".spe"
+        new_file_path = os.path.join(dest_path,file_mod)
+        if (os.path.isfile(new_file_path) == False):
+            shutil.copyfile(entry.path, new_file_path)
     return None
 
 
@@ -24,7 +24,11 @@
 # In[1]:
 
 import os
+import sys
 import xml.etree.ElementTree as ET
+sys.path.append(os.path.join(os.path.dirname(os.getcwd()), "spe_common"))
+import spe_io
+import file_scan
 
 
 # ## Functions to Write Each XMSO Output to a New File
@@ -32,55 +36,40 @@ import xml.etree.ElementTree as ET
 # In[2]:
 
 def xmso_to_csv(input_folder, output_folder):
-    for root, dirs, files in os.walk(input_folder):
-        for file in files:
-            path = os.path.join(root, file)
-            name, ext = os.path.splitext(file)
-            if ext == '.xmso':
-                data = []
-                xml_tree = ET.parse(path)
-                xml_root = xml_tree.getroot()
-                xml_spectrum_conv = xml_root[1]
-                for channel in xml_spectrum_conv:
-                    data.append([channel[1].text, channel[5].text])
-
-                output_name = name + ".csv"
-                output_path = os.path.join(output_folder, output_name)
-                output_file = open(output_path, 'w+')
-                for value in data:
-                    output_file.write("{:s},{:s}\n".format(value[0],value[1]))
-                output_file.close()
+    for entry in file_scan.scan(input_folder, ".xmso"):
+        path = entry.path
+        name, ext = os.path.splitext(os.path.basename(path))
+        data = []
+        xml_tree = ET.parse(path)
+        xml_root = xml_tree.getroot()
+        xml_spectrum_conv = xml_root[1]
+        for channel in xml_spectrum_conv:
+            data.append([channel[1].text, channel[5].text])
+
+        output_name = name + ".csv"
+        output_path = os.path.join(output_folder, output_name)
+        output_file = open(output_path, 'w+')
+        for value in data:
+            output_file.write("{:s},{:s}\n".format(value[0],value[1]))
+        output_file.close()
 
 
 # In[3]:
 
 def xmso_to_spe(input_folder, output_folder):
-    for root, dirs, files in os.walk(input_folder):
-        for file in files:
-            path = os.path.join(root, file)
-            name, ext = os.path.splitext(file)
-            if ext == '.xmso':
-                data = []
-                xml_tree = ET.parse(path)
-                xml_root = xml_tree.getroot()
-                xml_spectrum_conv = xml_root[1]
-                for channel in xml_spectrum_conv:
-                    data.append(channel[5].text)
-                ndata = len(data)
-                
-                output_name = name + ".spe"
-                output_path = os.path.join(output_folder, output_name)
-                output_file = open(output_path, 'w+')
-                
-                output_file.write("$DATA:\n")
-                output_file.write("0   2047\n")
-                for i, value in enumerate(data):
-                    if ((((i+1)%6 == 0) and (i > 0)) or (i == (ndata-1))):
-                        output_file.write("{:s}\n".format(value))
-                    else:
-                        output_file.write("{:s}    ".format(value))
-                
-                output_file.close()
+    for entry in file_scan.scan(input_folder, ".xmso"):
+        path = entry.path
+        name, ext = os.path.splitext(os.path.basename(path))
+        data = []
+        xml_tree = ET.parse(path)
+        xml_root = xml_tree.getroot()
+        xml_spectrum_conv = xml_root[1]
+        for channel in xml_spectrum_conv:
+            data.append(channel[5].text)
+        
+        output_name = name + ".spe"
+        output_path = os.path.join(output_folder, output_name)
+        spe_io.write_spe(output_path, data, per_line=6, fmt="{:s}", sep="    ", range_sep="   ")
 
 
 # ## Running the Program
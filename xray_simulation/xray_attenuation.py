@@ -8,7 +8,8 @@
 # In[6]:
 
 import numpy as np
-import xraylib_np as xraylib
+import xray_cache as cache
+import xray_tables as mu_tables
 from numba import jit
 
 
@@ -16,7 +17,6 @@ from numba import jit
 
 # In[7]:
 
-@jit
 def unpack(material):
     Z = []
     C = []
@@ -30,11 +30,13 @@ def unpack(material):
 
 # In[8]:
 
-@jit
-def calc_mu_rho(mat, comps, rhos, energies):
+def calc_mu_rho(mat, comps, rhos, energies, mu_table=None):
     Z,C = unpack(comps[mat])
     rho = rhos[mat]
-    mu_Z = xraylib.CS_Total(Z, energies)
+    if mu_table is None:
+        mu_Z = cache.CS_Total(Z, energies)
+    else:
+        mu_Z = mu_tables.interp_mu(mu_table, Z, energies)
     mu = np.tensordot(mu_Z, C, axes=([0],[0]))
     mu_rho = mu * rho
     return mu_rho
@@ -42,31 +44,45 @@ def calc_mu_rho(mat, comps, rhos, energies):
 
 # In[10]:
 
-@jit
+@jit(nopython=True, cache=True)
 def attenuate(incoming, mu_rho, t): 
     transmit = np.copy(incoming)
     interact = np.copy(incoming)
-    transmit[:,1] = incoming[:,1] * np.exp(-mu_rho[:] * t)
-    interact[:,1] = incoming[:,1] - transmit[:,1]
+    attenuate_counts(incoming[:,1], mu_rho, t, transmit[:,1], interact[:,1])
     return transmit, interact
 
 
+# Counts-only form: writes transmitted and interacting counts into out and interact, which may be the incoming counts array itself
+
+# In[ ]:
+
+@jit(nopython=True, cache=True)
+def attenuate_counts(counts, mu_rho, t, out, interact):
+    for i in range(len(counts)):
+        c = counts[i]
+        tr = c * np.exp(-mu_rho[i] * t)
+        out[i] = tr
+        interact[i] = c - tr
+    return out, interact
+
+
 # ## Calculate mu_rho and Attenuation for Multiple Materials
 
 # Based on materials dictionary and path array of forms: 
 # 
 # materials = {'mat1': 1, 'mat2': 2, 'mat3': 3, ...}  
 # path = [[t1, 1], [t3, 3], [t2, 2], ...]
+# 
+# Passing mu_table (from xray_tables.get_mu_table) interpolates mu/rho from the precomputed table instead of calling xraylib
 
 # In[9]:
 
-@jit
-def calc_mu_rho_arr(materials, comps, rhos, energies):
+def calc_mu_rho_arr(materials, comps, rhos, energies, mu_table=None):
     mu_rho_arr = np.ndarray(shape=(len(energies),(len(materials)+1)), dtype=float)
     mu_rho_arr[:,0] = energies
     for num in materials:
         mat = materials[num]
-        mu_rho = calc_mu_rho(mat, comps, rhos, energies)
+        mu_rho = calc_mu_rho(mat, comps, rhos, energies, mu_table)
         mu_rho_arr[:,num] = mu_rho
     return mu_rho_arr
 
@@ -76,18 +92,87 @@ def calc_mu_rho_arr(materials, comps, rhos, energies):
 def attenuate_path(incoming, path, mu_rho_arr):
     transmit = np.copy(incoming)
     interact = np.copy(incoming)
-    for seg in path:
-        mu_rho = mu_rho_arr[:,int(seg[1])]
-        transmit[:,1] = transmit[:,1] * np.exp(-mu_rho[:] * seg[0])
-    interact[:,1] = incoming[:,1] - transmit[:,1]
+    attenuate_path_counts(incoming[:,1], np.asarray(path, dtype=float).reshape(-1,2), mu_rho_arr, transmit[:,1], interact[:,1])
     return transmit, interact
 
 
+# Counts-only form of attenuate_path, with path as an (n_segments, 2) array. out and interact may be the incoming counts array itself.
+
+# In[ ]:
+
+@jit(nopython=True, cache=True)
+def attenuate_path_counts(counts, path, mu_rho_arr, out, interact):
+    for i in range(len(counts)):
+        c = counts[i]
+        tr = c
+        for k in range(path.shape[0]):
+            tr = tr * np.exp(-mu_rho_arr[i,int(path[k,1])] * path[k,0])
+        out[i] = tr
+        interact[i] = c - tr
+    return out, interact
+
+
+# ## Attenuation for Many Paths at Once
+
+# paths is a padded array of shape (n_rays, n_segments, 2) holding the [t, material number] segments of each ray, with unused segments set to t = 0 (pad_paths builds one from a list of paths). Thicknesses are summed per material first, so each ray-energy pair needs a single exponential. dtype=np.float32 computes the [ray,E] arrays in single precision.
+
+# In[ ]:
+
+def pad_paths(path_list):
+    n_segs = max([len(path) for path in path_list] + [1])
+    paths = np.zeros(shape=(len(path_list), n_segs, 2), dtype=float)
+    for i, path in enumerate(path_list):
+        if len(path) > 0:
+            paths[i,:len(path),:] = path
+    return paths
+
+
+# In[ ]:
+
+def sum_path_thickness(paths, n_materials):
+    n_rays = paths.shape[0]
+    mats = paths[:,:,1].astype(int)
+    flat = np.arange(n_rays)[:,np.newaxis] * (n_materials+1) + mats
+    thick = np.bincount(flat.ravel(), weights=paths[:,:,0].ravel(), minlength=n_rays*(n_materials+1))
+    thick = thick.reshape(n_rays, n_materials+1)
+    return thick[:,1:]
+
+
+# In[ ]:
+
+def attenuate_paths(incoming, paths, mu_rho_arr, dtype=np.float64):
+    thick = sum_path_thickness(paths, mu_rho_arr.shape[1]-1).astype(dtype)
+    counts = incoming[:,1].astype(dtype)
+    transmit = np.dot(thick, mu_rho_arr[:,1:].T.astype(dtype))
+    np.exp(-transmit, out=transmit)
+    transmit *= counts[np.newaxis,:]
+    interact = counts[np.newaxis,:] - transmit
+    return transmit, interact
+
+
+# Total transmitted counts per ray, processed chunk_size rays at a time to bound memory for large ray counts (e.g. one ray per detector pixel)
+
+# In[ ]:
+
+def transmitted_totals(incoming, paths, mu_rho_arr, chunk_size=4096, dtype=np.float64):
+    n_rays = paths.shape[0]
+    mu_rho_T = mu_rho_arr[:,1:].T.astype(dtype)
+    counts = incoming[:,1].astype(dtype)
+    totals = np.zeros(n_rays, dtype=dtype)
+    for start in range(0, n_rays, chunk_size):
+        stop = min(start + chunk_size, n_rays)
+        thick = sum_path_thickness(paths[start:stop], mu_rho_arr.shape[1]-1).astype(dtype)
+        transmit = np.dot(thick, mu_rho_T)
+        np.exp(-transmit, out=transmit)
+        totals[start:stop] = np.dot(transmit, counts)
+    return totals
+
+
 # ## Calculate Solid Angles
 
 # In[11]:
 
-@jit
+@jit(nopython=True, cache=True)
 def calc_omega_cone(radius, distance):
     theta = np.arctan(radius / distance)
     omega = 2 * np.pi * (1 - np.cos(theta))
@@ -96,7 +181,7 @@ def calc_omega_cone(radius, distance):
 
 # In[12]:
 
-@jit
+@jit(nopython=True, cache=True)
 def calc_omega_pyramid(a_side, b_side, distance):
     numer = a_side * b_side
     denom = 2 * distance * np.sqrt(4*distance**2 + a_side**2 + a_side**2)
@@ -0,0 +1,214 @@
+
+# coding: utf-8
+
+# # Benchmarks for the Simulation Modules
+#
+# Times spectrum, emission_bulk, fluor_K_bulk, compton_bulk, detected and attenuate_path on fixed fixtures: a Rh anode at 10, 30 and 50 kV, 2048-channel energy grids (1 keV + 20 eV steps), and 5, 15 and 30 element matrices.
+#
+# JIT compile time is measured separately by xray_jit.warm_start() before anything else runs. For each case the first call (which fills the xraylib cache) is timed on its own, then the steady-state time is the median of the repeats. Throughput is 1/median in spectra per second, and peak memory is the tracemalloc peak of one steady-state call.
+#
+# Results can be saved as a JSON baseline and later runs compared against it:
+#
+#     python xray_benchmark.py baseline.json
+#
+# writes baseline.json if it does not exist, otherwise compares against it.
+
+# ## Imports
+
+# In[1]:
+
+import os
+import sys
+import json
+import time
+import platform
+import tracemalloc
+import numpy as np
+import numba
+import xray_jit
+import xray_source as src
+import xray_emission as emis
+import xray_detection as det
+import xray_attenuation as att
+
+
+# ## Fixtures
+
+# In[2]:
+
+anode_Z = 45
+kVp_vals = [10.0, 30.0, 50.0]
+n_channels = 2048
+dE = 0.02
+matrix_Z = [8, 14, 13, 26, 20, 12, 11, 19, 22, 15, 25, 16, 17, 38, 56,
+            40, 30, 29, 28, 24, 23, 35, 37, 39, 33, 27, 57, 82, 50, 6]
+matrix_sizes = [5, 15, 30]
+
+
+# In[3]:
+
+def make_matrix(n_Z):
+    Z_arr = np.array(matrix_Z[:n_Z])
+    C_arr = 1.0 / np.arange(1, n_Z+1)
+    C_arr = C_arr / np.sum(C_arr)
+    return Z_arr, C_arr
+
+
+# In[4]:
+
+def make_beam(kVp):
+    tube = src.spectrum(anode_Z, kVp, 1.0, 1.0, 80.0, 10.0, dE)
+    beam = np.zeros(shape=(n_channels, 2))
+    beam[:,0] = 1.0 + dE*np.arange(n_channels)
+    n = min(len(tube), n_channels)
+    beam[:n,1] = tube[:n,1]
+    return beam
+
+
+# In[5]:
+
+def make_path_materials(energies):
+    materials = {1: 'window', 2: 'air', 3: 'water'}
+    comps = {'window': {4: 1.0}, 'air': {7: 0.755, 8: 0.232, 18: 0.013}, 'water': {1: 0.111, 8: 0.889}}
+    rhos = {'window': 1.85, 'air': 0.0012, 'water': 1.0}
+    mu_rho_arr = att.calc_mu_rho_arr(materials, comps, rhos, energies)
+    path = [[0.0025, 1], [1.0, 2], [0.01, 3]]
+    return path, mu_rho_arr
+
+
+# In[6]:
+
+def benchmark_cases():
+    cases = []
+    for kVp in kVp_vals:
+        beam = make_beam(kVp)
+        cases.append(("spectrum[{:.0f}kV]".format(kVp),
+                      src.spectrum, (anode_Z, kVp, 1.0, 1.0, 80.0, 10.0, dE)))
+        for n_Z in matrix_sizes:
+            Z_arr, C_arr = make_matrix(n_Z)
+            tag = "[{:.0f}kV,{:d}el]".format(kVp, n_Z)
+            cases.append(("emission_bulk" + tag, emis.emission_bulk, (Z_arr, C_arr, beam, 45.0, 45.0)))
+            cases.append(("fluor_K_bulk" + tag, emis.fluor_K_bulk, (Z_arr, C_arr, beam, 45.0, 45.0)))
+            cases.append(("compton_bulk" + tag, emis.compton_bulk, (Z_arr, C_arr, beam, 45.0, 45.0)))
+        cases.append(("detected[{:.0f}kV]".format(kVp), det.detected, (beam, 0.05, 0.003)))
+        path, mu_rho_arr = make_path_materials(beam[:,0])
+        cases.append(("attenuate_path[{:.0f}kV]".format(kVp), att.attenuate_path, (beam, path, mu_rho_arr)))
+    return cases
+
+
+# ## Timing
+
+# In[7]:
+
+def time_case(func, args, repeats):
+    t0 = time.perf_counter()
+    func(*args)
+    first = time.perf_counter() - t0
+
+    times = np.zeros(repeats)
+    for k in range(repeats):
+        t0 = time.perf_counter()
+        func(*args)
+        times[k] = time.perf_counter() - t0
+
+    tracemalloc.start()
+    func(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    median = float(np.median(times))
+    result = {'first_call_s': first, 'median_s': median, 'min_s': float(np.min(times)),
+              'spectra_per_s': (1.0 / median) if median > 0 else float('inf'),
+              'peak_mem_bytes': int(peak)}
+    return result
+
+
+# In[8]:
+
+def run_benchmarks(repeats=20, name_filter=None):
+    t0 = time.perf_counter()
+    compile_report = xray_jit.warm_start(verbose=False)
+    compile_total = time.perf_counter() - t0
+
+    results = {}
+    for name, func, args in benchmark_cases():
+        if (name_filter is not None) and (name.find(name_filter) == -1):
+            continue
+        results[name] = time_case(func, args, repeats)
+
+    report = {'meta': {'python': platform.python_version(), 'numpy': np.__version__,
+                       'numba': numba.__version__, 'machine': platform.machine(),
+                       'repeats': repeats},
+              'compile': {'total_s': compile_total, 'kernels': compile_report},
+              'results': results}
+    return report
+
+
+# ## Reporting and Baselines
+
+# In[9]:
+
+def print_report(report):
+    print("JIT warm start: {:.3f} s".format(report['compile']['total_s']))
+    print("{:36s} {:>10s} {:>10s} {:>12s} {:>10s}".format("case", "first ms", "median ms", "spectra/s", "peak MB"))
+    for name, res in report['results'].items():
+        print("{:36s} {:10.2f} {:10.3f} {:12.1f} {:10.2f}".format(
+            name, 1e3*res['first_call_s'], 1e3*res['median_s'], res['spectra_per_s'], res['peak_mem_bytes']/2**20))
+    return None
+
+
+# In[10]:
+
+def save_baseline(report, path):
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+    return None
+
+
+# In[11]:
+
+def load_baseline(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+# Ratio of current to baseline median time for each case found in both; cases slower than tolerance are flagged
+
+# In[12]:
+
+def compare(report, baseline, tolerance=1.2):
+    rows = []
+    for name, res in report['results'].items():
+        if name not in baseline['results']:
+            continue
+        base = baseline['results'][name]
+        ratio = res['median_s'] / base['median_s'] if base['median_s'] > 0 else float('inf')
+        mem_ratio = res['peak_mem_bytes'] / max(base['peak_mem_bytes'], 1)
+        rows.append({'case': name, 'time_ratio': ratio, 'mem_ratio': mem_ratio,
+                     'regressed': ratio > tolerance})
+    return rows
+
+
+# In[13]:
+
+def print_comparison(rows):
+    print("{:36s} {:>10s} {:>10s}".format("case", "time x", "memory x"))
+    for row in rows:
+        flag = "  REGRESSED" if row['regressed'] else ""
+        print("{:36s} {:10.3f} {:10.3f}{:s}".format(row['case'], row['time_ratio'], row['mem_ratio'], flag))
+    return None
+
+
+# ## Running the Benchmarks
+
+# In[14]:
+
+if __name__ == '__main__':
+    report = run_benchmarks()
+    print_report(report)
+    if len(sys.argv) > 1:
+        baseline_path = sys.argv[1]
+        if os.path.isfile(baseline_path):
+            print_comparison(compare(report, load_baseline(baseline_path)))
+        else:
+            save_baseline(report, baseline_path)
@@ -0,0 +1,126 @@
+
+# coding: utf-8
+
+# # Binning Energies onto a Spectrum Grid
+#
+# Nopython kernels that place many energies onto an energy grid in one pass and accumulate their intensities. On a uniform grid each energy goes to the same row as calc_Erow (nearest row, clamped to the grid). Non-uniform grids are handled by searching for the nearest grid energy. With split=True, intensity is instead shared linearly between the two rows bracketing each energy.
+
+# ## Imports
+
+# In[1]:
+
+import numpy as np
+from numba import jit
+
+
+# ## Grid Checks
+
+# In[2]:
+
+@jit(nopython=True, cache=True)
+def is_uniform(energies):
+    delE = energies[1] - energies[0]
+    tol = 1e-6 * abs(delE)
+    for i in range(1, len(energies)-1):
+        if abs((energies[i+1] - energies[i]) - delE) > tol:
+            return False
+    return True
+
+
+# ## Row Indices
+
+# In[3]:
+
+@jit(nopython=True, cache=True)
+def energy_rows(E_arr, energies):
+    n = len(energies)
+    rows = np.zeros(len(E_arr), dtype=np.int64)
+    if is_uniform(energies):
+        minE = energies[0]
+        delE = energies[1] - energies[0]
+        max_steps = np.around((energies[n-1] - minE)/delE)
+        for i in range(len(E_arr)):
+            num_steps = np.around((E_arr[i] - minE)/delE)
+            if (num_steps < 0):
+                num_steps = 0
+            elif (num_steps > max_steps):
+                num_steps = max_steps
+            rows[i] = int(num_steps)
+    else:
+        for i in range(len(E_arr)):
+            k = np.searchsorted(energies, E_arr[i])
+            if k <= 0:
+                rows[i] = 0
+            elif k >= n:
+                rows[i] = n-1
+            elif (E_arr[i] - energies[k-1]) <= (energies[k] - E_arr[i]):
+                rows[i] = k-1
+            else:
+                rows[i] = k
+    return rows
+
+
+# ## Accumulation
+
+# The *_add kernels add into an existing out array (which may already hold counts), so callers can reuse buffers
+
+# In[4]:
+
+@jit(nopython=True, cache=True)
+def bin_nearest_add(E_arr, weights, energies, out):
+    rows = energy_rows(E_arr, energies)
+    for i in range(len(rows)):
+        out[rows[i]] += weights[i]
+    return out
+
+
+# In[5]:
+
+@jit(nopython=True, cache=True)
+def bin_split_add(E_arr, weights, energies, out):
+    n = len(energies)
+    for i in range(len(E_arr)):
+        k = np.searchsorted(energies, E_arr[i], side='right') - 1
+        if k < 0:
+            out[0] += weights[i]
+        elif k >= n-1:
+            out[n-1] += weights[i]
+        else:
+            frac = (E_arr[i] - energies[k]) / (energies[k+1] - energies[k])
+            out[k] += (1.0 - frac) * weights[i]
+            out[k+1] += frac * weights[i]
+    return out
+
+
+# In[6]:
+
+@jit(nopython=True, cache=True)
+def bin_nearest(E_arr, weights, energies):
+    return bin_nearest_add(E_arr, weights, energies, np.zeros(len(energies)))
+
+
+# In[7]:
+
+@jit(nopython=True, cache=True)
+def bin_split(E_arr, weights, energies):
+    return bin_split_add(E_arr, weights, energies, np.zeros(len(energies)))
+
+
+# ## Main Functions to Call
+
+# In[8]:
+
+@jit(nopython=True, cache=True)
+def bin_counts(E_arr, weights, energies, split=False):
+    if split:
+        return bin_split(E_arr, weights, energies)
+    return bin_nearest(E_arr, weights, energies)
+
+
+# In[9]:
+
+@jit(nopython=True, cache=True)
+def bin_counts_add(E_arr, weights, energies, out, split=False):
+    if split:
+        return bin_split_add(E_arr, weights, energies, out)
+    return bin_nearest_add(E_arr, weights, energies, out)
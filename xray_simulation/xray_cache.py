@@ -0,0 +1,155 @@
+
+# coding: utf-8
+
+# # Cached X-Ray Cross Sections
+#
+# Memoizes the xraylib_np cross-section lookups used by the simulation modules, keyed on (function, Z set, energy grid, angle). Entries are evicted least-recently-used once the cache holds more than max_bytes of arrays. The cache can be saved to an npz file and loaded back so that a new process starts warm.
+
+# ## Imports
+
+# In[1]:
+
+import os
+import hashlib
+from collections import OrderedDict
+import numpy as np
+import xraylib_np as xraylib
+
+
+# ## Cache State
+
+# In[2]:
+
+table = OrderedDict()
+state = {'max_bytes': 256 * (2**20), 'nbytes': 0, 'hits': 0, 'misses': 0}
+
+
+# ## Cache Management
+
+# In[3]:
+
+def make_key(name, args):
+    digest = hashlib.blake2b(digest_size=16)
+    for arg in args:
+        arr = np.ascontiguousarray(arg)
+        digest.update(str(arr.dtype).encode())
+        digest.update(str(arr.shape).encode())
+        digest.update(arr.tobytes())
+    return name + "_" + digest.hexdigest()
+
+
+# In[4]:
+
+def store(key, vals):
+    vals = np.asarray(vals)
+    vals.flags.writeable = False
+    if key in table:
+        state['nbytes'] -= table[key].nbytes
+    table[key] = vals
+    table.move_to_end(key)
+    state['nbytes'] += vals.nbytes
+    while (state['nbytes'] > state['max_bytes']) and (len(table) > 1):
+        _, old = table.popitem(last=False)
+        state['nbytes'] -= old.nbytes
+    return vals
+
+
+# In[5]:
+
+def lookup(name, *args):
+    key = make_key(name, args)
+    if key in table:
+        table.move_to_end(key)
+        state['hits'] += 1
+        return table[key]
+    state['misses'] += 1
+    vals = getattr(xraylib, name)(*args)
+    return store(key, vals)
+
+
+# In[6]:
+
+def set_max_bytes(max_bytes):
+    state['max_bytes'] = max_bytes
+    while (state['nbytes'] > state['max_bytes']) and (len(table) > 0):
+        _, old = table.popitem(last=False)
+        state['nbytes'] -= old.nbytes
+    return None
+
+
+# In[7]:
+
+def clear():
+    table.clear()
+    state['nbytes'] = 0
+    state['hits'] = 0
+    state['misses'] = 0
+    return None
+
+
+# In[8]:
+
+def stats():
+    return {'entries': len(table), 'nbytes': state['nbytes'], 'max_bytes': state['max_bytes'],
+            'hits': state['hits'], 'misses': state['misses']}
+
+
+# ## On-Disk Persistence
+
+# In[9]:
+
+def save(path):
+    np.savez(path, **table)
+    return None
+
+
+# In[10]:
+
+def load(path):
+    if (os.path.isfile(path) == False):
+        return 0
+    with np.load(path) as data:
+        for key in data.files:
+            store(key, data[key])
+        n_loaded = len(data.files)
+    return n_loaded
+
+
+# ## Cached Lookups
+
+# Same arguments and return shapes as the xraylib_np functions of the same name
+
+# In[11]:
+
+def CS_Total(Z_arr, energies):
+    return lookup('CS_Total', Z_arr, energies)  ## [Z,E]
+
+
+# In[12]:
+
+def CS_Photo(Z_arr, energies):
+    return lookup('CS_Photo', Z_arr, energies)  ## [Z,E]
+
+
+# In[13]:
+
+def CS_Photo_Partial(Z_arr, shells, energies):
+    return lookup('CS_Photo_Partial', Z_arr, shells, energies)  ## [Z,shell,E]
+
+
+# In[14]:
+
+def DCS_Rayl(Z_arr, energies, thetas):
+    return lookup('DCS_Rayl', Z_arr, energies, thetas)  ## [Z,E,theta]
+
+
+# In[15]:
+
+def DCS_Compt(Z_arr, energies, thetas):
+    return lookup('DCS_Compt', Z_arr, energies, thetas)  ## [Z,E,theta]
+
+
+# In[16]:
+
+def ComptonEnergy(energies, thetas):
+    return lookup('ComptonEnergy', energies, thetas)  ## [E,theta]
@@ -10,6 +10,7 @@
 # In[18]:
 
 import numpy as np
+import scipy.sparse as sparse
 from numba import jit
 
 
@@ -19,7 +20,7 @@ from numba import jit
 
 ## g(x) = [1/(std*sqrt(2pi))]*exp(-(1/2)*((x-mean)/std)^2)
 
-@jit
+@jit(nopython=True, cache=True)
 def gaussian_noise(energies, Emean, Estd):
     noise = np.copy(energies)
     delta = energies[1] - energies[0]
@@ -32,18 +33,129 @@ def gaussian_noise(energies, Emean, Estd):
     return noise
 
 
+# ## Detector Response Matrix
+
+# Column e of the response holds gaussian_noise(energies, Emean[e], Estd[e]), truncated to +/- n_sigma standard deviations and stored as a sparse banded matrix, so that detected counts = response . emitted counts.
+
+# In[ ]:
+
+response_cache = {}
+response_cache_size = 16
+
+
+# In[ ]:
+
+def gaussian_response(energies, Emean, Estd, n_sigma):
+    delta = energies[1] - energies[0]
+    lo = np.searchsorted(energies, Emean - n_sigma*Estd, side='left')
+    hi = np.searchsorted(energies, Emean + n_sigma*Estd, side='right')
+    widths = hi - lo
+    cols = np.repeat(np.arange(len(Emean)), widths)
+    rows = np.arange(np.sum(widths)) + np.repeat(lo - (np.cumsum(widths) - widths), widths)
+    b = Emean[cols]
+    c = Estd[cols]
+    a = (1/(c*np.sqrt(2*np.pi)))
+    en = -(energies[rows]-b)**2
+    ed = 2*c**2
+    vals = delta*a*np.exp(en/ed)
+    response = sparse.csr_matrix((vals, (rows, cols)), shape=(len(energies), len(Emean)))
+    return response
+
+
+# In[ ]:
+
+def store_response(key, response):
+    if len(response_cache) >= response_cache_size:
+        response_cache.pop(next(iter(response_cache)))
+    response_cache[key] = response
+    return response
+
+
+# In[ ]:
+
+def response_matrix(energies, offset_noise, gain_noise, n_sigma=5.0, cache=True, dtype=np.float64):
+    key = ('noise', len(energies), hash(energies.tobytes()), offset_noise, gain_noise, n_sigma, np.dtype(dtype).str)
+    if cache and (key in response_cache):
+        return response_cache[key]
+    noise = gain_noise*energies + offset_noise
+    response = gaussian_response(energies, energies, noise, n_sigma).astype(dtype)
+    if cache:
+        store_response(key, response)
+    return response
+
+
+# ## Response from a Detector Calibration
+
+# Uses the zero/gain/noise/fano values from the AXML fits. Channel energies are zero + gain*channel (keV), and the peak width follows FWHM^2 = noise^2 + 2.3548^2 * fano * 0.00385 * E, with noise as a FWHM in keV and 3.85 eV per electron-hole pair in Si.
+
+# In[ ]:
+
+def calibrated_response(energies, zero, gain, noise, fano, n_channels=2048, n_sigma=5.0, cache=True, dtype=np.float64):
+    key = ('calib', len(energies), hash(energies.tobytes()), zero, gain, noise, fano, n_channels, n_sigma, np.dtype(dtype).str)
+    if cache and (key in response_cache):
+        return response_cache[key]
+    channel_E = zero + gain*np.arange(n_channels)
+    fwhm_sq = noise**2 + (2.3548**2)*fano*0.00385*energies.clip(min=0)
+    Estd = np.sqrt(fwhm_sq) / 2.3548
+    response = (channel_E, gaussian_response(channel_E, energies, Estd, n_sigma).astype(dtype))
+    if cache:
+        store_response(key, response)
+    return response
+
+
 # ## Main Function to Call
 
 # In[20]:
 
-@jit
-def detected(emission, offset_noise, gain_noise):
+def detected(emission, offset_noise, gain_noise, n_sigma=5.0, cache=True):
     detected = np.copy(emission)
-    detected[:,1] = 0
-    energies = emission[:,0]
-    for e,_ in enumerate(energies):
-        noise = gain_noise*e + offset_noise
-        vals = emission[e,1] * gaussian_noise(energies, e, noise)
-        detected[:,1] = detected[:,1] + vals
+    detected_counts(emission[:,0], emission[:,1], offset_noise, gain_noise, n_sigma, cache, out=detected[:,1])
     return detected
 
+
+# ## Detection into an Existing Buffer
+
+# The response is applied by a compiled CSR product that writes straight into out. out must not be the counts array itself, since every channel reads several emitted channels.
+
+# In[ ]:
+
+@jit(nopython=True, cache=True)
+def csr_dot(indptr, indices, data, x, out):
+    for r in range(len(indptr)-1):
+        acc = 0.0
+        for k in range(indptr[r], indptr[r+1]):
+            acc += data[k] * x[indices[k]]
+        out[r] = acc
+    return out
+
+
+# In[ ]:
+
+def detected_counts(energies, counts, offset_noise, gain_noise, n_sigma=5.0, cache=True, out=None):
+    dtype = np.float32 if counts.dtype == np.float32 else np.float64
+    response = response_matrix(energies, offset_noise, gain_noise, n_sigma, cache, dtype)
+    if out is None:
+        out = np.zeros(response.shape[0], dtype=dtype)
+    return csr_dot(response.indptr, response.indices, response.data, counts, out)
+
+
+# ## Batches of Spectra on a Shared Energy Grid
+
+# counts is a single spectrum (n_channels) or a stack (n_spectra x n_channels) on the grid in energies. Stacks go through detected_stack() rather than detected(): detected() takes an (N, 2) [energy, counts] array, and a bare stack of two-channel spectra would look the same, so the two inputs cannot be told apart by shape. dtype=np.float32 computes in single precision, halving the memory traffic of large stacks.
+
+# In[ ]:
+
+def detected_stack(energies, counts, offset_noise, gain_noise, n_sigma=5.0, cache=True, dtype=np.float64):
+    response = response_matrix(energies, offset_noise, gain_noise, n_sigma, cache, dtype)
+    counts = np.asarray(counts, dtype=dtype)
+    detected = response.dot(counts.T).T
+    return detected
+
+
+# In[ ]:
+
+def detected_calibrated(energies, counts, zero, gain, noise, fano, n_channels=2048, n_sigma=5.0, cache=True, dtype=np.float64):
+    channel_E, response = calibrated_response(energies, zero, gain, noise, fano, n_channels, n_sigma, cache, dtype)
+    counts = np.asarray(counts, dtype=dtype)
+    detected = response.dot(counts.T).T
+    return channel_E, detected
@@ -11,6 +11,9 @@
 
 import numpy as np
 import xraylib_np as xraylib
+import xray_cache as cache
+import xray_binning as binning
+import xray_tables as mu_tables
 from numba import jit
 
 
@@ -18,14 +21,12 @@ from numba import jit
 
 # In[45]:
 
-@jit
 def div_aDa(num_a, den_a):
     return np.divide(num_a, den_a, out=np.zeros_like(num_a), where=den_a!=0)
 
 
 # In[46]:
 
-@jit
 def div_aDn(num_a, den_n):
     if den_n != 0:
         return num_a / den_n
@@ -35,7 +36,6 @@ def div_aDn(num_a, den_n):
 
 # In[47]:
 
-@jit
 def div_nDa(num_n, den_a):
     num_a = np.full(len(den_a), num_n, dtype=den_a.dtype)
     return np.divide(num_a, den_a, out=np.zeros_like(num_a), where=den_a!=0)
@@ -43,7 +43,6 @@ def div_nDa(num_n, den_a):
 
 # In[48]:
 
-@jit
 def div_nDn(num_n, den_n):
     if den_n != 0:
         return num_n / den_n
@@ -55,7 +54,7 @@ def div_nDn(num_n, den_n):
 
 # In[49]:
 
-@jit
+@jit(nopython=True, cache=True)
 def calc_Erow(Ei, energies):
     minE = energies[0]
     maxE = energies[len(energies)-1]
@@ -71,13 +70,10 @@ def calc_Erow(Ei, energies):
 
 # In[50]:
 
-@jit
-def compton_shift(compton_E, EC):
+@jit(nopython=True, cache=True)
+def compton_shift(compton_E, EC, split=False):
     shifted = np.copy(compton_E)
-    shifted[:,1] = 0
-    for i,_ in enumerate(EC):
-        Erow = calc_Erow(EC[i], compton_E[:,0])
-        shifted[Erow,1] = shifted[Erow,1] + compton_E[i,1]
+    shifted[:,1] = binning.bin_counts(EC, compton_E[:,1], compton_E[:,0], split)
     return shifted
 
 
@@ -85,12 +81,7 @@ def compton_shift(compton_E, EC):
 
 # In[51]:
 
-@jit
-def fluor_K_bulk(Z_arr, C_arr, beam, phi_in, phi_out):
-    fluor = np.copy(beam)
-    fluor[:,1] = 0
-    sin_phi1 = np.sin(np.radians(phi_in))
-    sin_phi2 = np.sin(np.radians(phi_out))
+def fluor_K_tables(Z_arr, energies):
     lines = np.array([xraylib.KL3_LINE, xraylib.KL2_LINE, 
                       xraylib.KL1_LINE, xraylib.KM3_LINE, 
                       xraylib.KN3_LINE, xraylib.KM2_LINE, 
@@ -99,102 +90,372 @@ def fluor_K_bulk(Z_arr, C_arr, beam, phi_in, phi_out):
     
     ## Values from xraylib ##
     EKL = xraylib.LineEnergy(Z_arr, lines)  ## [Z,line]
-    muE = xraylib.CS_Total(Z_arr, beam[:,0])  ## [Z,E]
-    tauE = xraylib.CS_Photo(Z_arr, beam[:,0])  ## [Z,E]
-    sigmaKE = xraylib.CS_Photo_Partial(Z_arr, shells, beam[:,0])  ## [Z,shell,E]
+    muE = cache.CS_Total(Z_arr, energies)  ## [Z,E]
+    tauE = cache.CS_Photo(Z_arr, energies)  ## [Z,E]
+    sigmaKE = cache.CS_Photo_Partial(Z_arr, shells, energies)  ## [Z,shell,E]
     wK = xraylib.FluorYield(Z_arr, shells)  ## [Z,shell]
     pKL = xraylib.RadRate(Z_arr, lines)  ## [Z,line]
     
+    ## Flattened to one row per (element, line), element-major ##
+    n_Z, n_lines = EKL.shape
+    line_el = np.repeat(np.arange(n_Z), n_lines)
+    line_id = np.tile(lines, n_Z)
+    line_E = EKL.ravel()
+    line_row = binning.energy_rows(line_E, energies)
+    line_w = (wK[:,0:1] * pKL).ravel()
+    line_sigma = sigmaKE[line_el,0,:]
+    
+    tables = {'el':line_el, 'id':line_id, 'E':line_E, 'row':line_row, 'w':line_w,
+              'sigma':line_sigma, 'mu':muE, 'tau':tauE}
+    return tables
+
+
+# In[ ]:
+
+def fluor_from_tables(C_arr, beam, tables, phi_in, phi_out, accumulate=False):
+    fluor = np.copy(beam)
+    fluor_counts_from_tables(C_arr, beam[:,1], tables, phi_in, phi_out, accumulate, out=fluor[:,1])
+    return fluor
+
+
+# Counts-only form of fluor_from_tables. Line intensities are computed before out is written, so out may be the beam counts array itself.
+
+# In[ ]:
+
+def fluor_counts_from_tables(C_arr, counts, tables, phi_in, phi_out, accumulate=False, out=None):
+    sin_phi1 = np.sin(np.radians(phi_in))
+    sin_phi2 = np.sin(np.radians(phi_out))
+    el = tables['el']
+    row = tables['row']
+    sigma = tables['sigma']  ## [line,E]
+    tau = tables['tau'][el,:]  ## [line,E]
+    
     ## muSE is mass attenuation coefficient for sample ##
-    muSE = np.tensordot(muE, C_arr, axes=([0],[0]))
+    muSE = np.tensordot(tables['mu'], C_arr, axes=([0],[0]))
     muSE_in = muSE / sin_phi1
     muSE_out = muSE / sin_phi2
+    muSE_j = muSE[row]
+    
+    ## Primary fluorescence, P[i,E] for each line i ##
+    eps = div_aDa(sigma, tau) * tables['w'][:,np.newaxis]
+    mu_sum = muSE_in[np.newaxis,:] + muSE_out[row][:,np.newaxis]
+    mu_corr = div_aDa(np.ones_like(mu_sum), mu_sum)
+    C_line = C_arr[el][:,np.newaxis]
+    P_arr = (1.0/(4.0*np.pi)) * (1.0/sin_phi1) * C_line * eps * tau * mu_corr
+    A_arr = counts[np.newaxis,:] * P_arr
+    primary = np.sum(A_arr, axis=1)
+    
+    ## Secondary fluorescence of line i by line j, factored so that only ##
+    ## [line,E] arrays are built and the E sums become matrix products   ##
+    ## Jratio * tau_corr = G[i,E] * H[i,j] * tau[j,E]                     ##
+    sig_tau = sigma * tau
+    G_arr = div_aDa(np.ones_like(sig_tau), sig_tau)
+    H_arr = sigma[:,row] * div_aDa(tau[:,row], np.broadcast_to(muSE_j, (len(row),len(row))))
+    F_arr = (1.0/2.0) * C_line * eps * tau
+    
+    L1_num = np.broadcast_to(muSE_j[np.newaxis,:], H_arr.shape)
+    L1_den = np.broadcast_to(muSE_out[row][:,np.newaxis], H_arr.shape)
+    L1 = div_aDa(L1_num, L1_den) * np.log(1.0 + div_aDa(L1_den, L1_num))
+    L2_num = np.broadcast_to(muSE_j[:,np.newaxis], F_arr.shape)
+    L2_den = np.broadcast_to(muSE_in[np.newaxis,:], F_arr.shape)
+    L2 = div_aDa(L2_num, L2_den) * np.log(1.0 + div_aDa(L2_den, L2_num))
+    
+    AG_arr = A_arr * G_arr
+    X_arr = np.dot(AG_arr, F_arr.T)
+    Y_arr = np.dot(AG_arr, (F_arr * L2).T)
+    mask = ((el[:,np.newaxis] != el[np.newaxis,:]) & 
+            (tables['id'][:,np.newaxis] != tables['id'][np.newaxis,:]))
+    secondary = np.sum(np.where(mask, H_arr * (L1 * X_arr + Y_arr), 0.0), axis=1)
+    
+    ## As in the loop form, the last line written to a channel wins, ##
+    ## unless accumulate is set, in which case lines are summed       ##
+    total = primary + secondary
+    if out is None:
+        out = np.zeros(len(counts))
+    if accumulate:
+        out[:] = np.bincount(row, weights=total, minlength=len(counts))
+        return out
+    _, first_rev = np.unique(row[::-1], return_index=True)
+    last = len(row) - 1 - first_rev
+    out[:] = 0
+    out[row[last]] = total[last]
+    return out
+
+
+# In[ ]:
+
+def fluor_K_bulk(Z_arr, C_arr, beam, phi_in, phi_out):
+    tables = fluor_K_tables(Z_arr, beam[:,0])
+    fluor = fluor_from_tables(C_arr, beam, tables, phi_in, phi_out)
+    return fluor
+
+
+# In[ ]:
+
+def fluor_K_bulk_counts(Z_arr, C_arr, energies, counts, phi_in, phi_out, out=None):
+    tables = fluor_K_tables(Z_arr, energies)
+    return fluor_counts_from_tables(C_arr, counts, tables, phi_in, phi_out, out=out)
+
+
+# ## Multi-Shell Fluorescence
+
+# Line energies, radiative rates and fluorescence yields for Z = 1-92 are looked up once per shell and kept in shell_tables. fluor_tables selects the rows for Z_arr and flattens the lines of every requested shell into the one-row-per-line form used by fluor_from_tables, so all shells are evaluated in a single pass. Lines that do not exist for an element are dropped, lines falling in the same channel are summed, and vacancy transfer between L subshells (Coster-Kronig) is not included. Add 'M4' and 'M5' to shells for M lines.
+
+# In[ ]:
+
+shell_lines = {
+    'K': (xraylib.K_SHELL, [xraylib.KL3_LINE, xraylib.KL2_LINE, xraylib.KL1_LINE, xraylib.KM3_LINE,
+                            xraylib.KN3_LINE, xraylib.KM2_LINE, xraylib.KN5_LINE, xraylib.KM5_LINE]),
+    'L1': (xraylib.L1_SHELL, [xraylib.L1M3_LINE, xraylib.L1M2_LINE, xraylib.L1N2_LINE, xraylib.L1N3_LINE]),
+    'L2': (xraylib.L2_SHELL, [xraylib.L2M4_LINE, xraylib.L2M1_LINE, xraylib.L2N4_LINE]),
+    'L3': (xraylib.L3_SHELL, [xraylib.L3M5_LINE, xraylib.L3M4_LINE, xraylib.L3M1_LINE,
+                              xraylib.L3N5_LINE, xraylib.L3N1_LINE]),
+    'M4': (xraylib.M4_SHELL, [xraylib.M4N6_LINE]),
+    'M5': (xraylib.M5_SHELL, [xraylib.M5N7_LINE, xraylib.M5N6_LINE]),
+}
+shell_tables = {}
+
+
+# In[ ]:
+
+def get_shell_table(shell):
+    if shell not in shell_tables:
+        shell_id, line_ids = shell_lines[shell]
+        Z_all = np.arange(1, 93)
+        lines = np.array(line_ids)
+        shell_tables[shell] = {'shell': shell_id, 'lines': lines,
+                               'E': xraylib.LineEnergy(Z_all, lines),  ## [Z-1,line]
+                               'rate': xraylib.RadRate(Z_all, lines),  ## [Z-1,line]
+                               'yield': xraylib.FluorYield(Z_all, np.array([shell_id]))[:,0]}  ## [Z-1]
+    return shell_tables[shell]
 
-    for i,_ in enumerate(Z_arr):
-        for k,_ in enumerate(lines):
-            Erow_i = calc_Erow(EKL[i,k], beam[:,0])
-            eps_i = div_aDa(sigmaKE[i,0,:],tauE[i,:]) * wK[i,0] * pKL[i,k]
-            mu_corr_i = div_nDa(1.0,(muSE_in[:] + muSE_out[Erow_i]))
-            
-            P_arr = (1.0/(4.0*np.pi)) * (1.0/sin_phi1) * C_arr[i] * eps_i * tauE[i,:] * mu_corr_i
-            fluor[Erow_i,1] = np.sum(beam[:,1] * P_arr)    
-    
-            for j,_ in enumerate(Z_arr):
-                for m,_ in enumerate(lines):
-                    if ((i!=j) and (k!=m)):
-                        Erow_j = calc_Erow(EKL[j,m], beam[:,0])
-                        eps_j = div_aDa(sigmaKE[j,0,:], tauE[j,:]) * wK[j,0] * pKL[j,m]
-                        Jratio = div_nDa(sigmaKE[i,0,Erow_j], sigmaKE[i,0,:])
-                        tau_corr = (div_aDa(tauE[j,:], tauE[i,:]) * 
-                                    div_nDn(tauE[i,Erow_j], muSE[Erow_j]))
-                        L1 = (div_nDn(muSE[Erow_j], muSE_out[Erow_i]) * 
-                              np.log(1.0 + div_nDn(muSE_out[Erow_i], muSE[Erow_j])))
-                        L2 = (div_nDa(muSE[Erow_j], muSE_in[:]) * 
-                              np.log(1.0 + div_aDn(muSE_in[:], muSE[Erow_j])))
-                        L = L1 + L2
-                        
-                        S_arr = P_arr * (1.0/2.0) * C_arr[j] * eps_j * Jratio * tau_corr * L
-                        fluor[Erow_i,1] = fluor[Erow_i,1] + np.sum(beam[:,1] * S_arr)
+
+# In[ ]:
+
+def fluor_tables(Z_arr, energies, shells=('K', 'L1', 'L2', 'L3'), mu_table=None):
+    shell_ids = np.array([shell_lines[shell][0] for shell in shells])
+    
+    ## Values from xraylib, or mu/rho from mu_table (xray_tables.get_mu_table) when given ##
+    if mu_table is None:
+        muE = cache.CS_Total(Z_arr, energies)  ## [Z,E]
+    else:
+        muE = mu_tables.interp_mu(mu_table, Z_arr, energies)  ## [Z,E]
+    tauE = cache.CS_Photo(Z_arr, energies)  ## [Z,E]
+    sigmaSE = cache.CS_Photo_Partial(Z_arr, shell_ids, energies)  ## [Z,shell,E]
+    
+    ## One row per existing (element, shell, line) ##
+    parts = {'el':[], 'shell':[], 'id':[], 'E':[], 'w':[]}
+    for s, shell in enumerate(shells):
+        table = get_shell_table(shell)
+        line_E = table['E'][Z_arr-1,:]
+        line_w = table['yield'][Z_arr-1][:,np.newaxis] * table['rate'][Z_arr-1,:]
+        exists = (line_E > 0) & (line_w > 0)
+        el, k = np.nonzero(exists)
+        parts['el'].append(el)
+        parts['shell'].append(np.full(len(el), s))
+        parts['id'].append(table['lines'][k])
+        parts['E'].append(line_E[exists])
+        parts['w'].append(line_w[exists])
+    line_el = np.concatenate(parts['el'])
+    line_E = np.concatenate(parts['E'])
+    
+    tables = {'el':line_el, 'id':np.concatenate(parts['id']), 'E':line_E,
+              'row':binning.energy_rows(line_E, energies), 'w':np.concatenate(parts['w']),
+              'sigma':sigmaSE[line_el,np.concatenate(parts['shell']),:], 'mu':muE, 'tau':tauE}
+    return tables
+
+
+# In[ ]:
+
+def fluor_bulk(Z_arr, C_arr, beam, phi_in, phi_out, shells=('K', 'L1', 'L2', 'L3')):
+    tables = fluor_tables(Z_arr, beam[:,0], shells)
+    fluor = fluor_from_tables(C_arr, beam, tables, phi_in, phi_out, accumulate=True)
     return fluor
 
 
+# In[ ]:
+
+def fluor_bulk_counts(Z_arr, C_arr, energies, counts, phi_in, phi_out, shells=('K', 'L1', 'L2', 'L3'), out=None):
+    tables = fluor_tables(Z_arr, energies, shells)
+    return fluor_counts_from_tables(C_arr, counts, tables, phi_in, phi_out, accumulate=True, out=out)
+
+
 # In[52]:
 
-@jit
 def rayleigh_bulk(Z_arr, C_arr, beam, phi_in, phi_out):
     rayleigh = np.copy(beam)
-    rayleigh[:,1] = 0
+    rayleigh_bulk_counts(Z_arr, C_arr, beam[:,0], beam[:,1], phi_in, phi_out, out=rayleigh[:,1])
+    return rayleigh
+
+
+# Scattered fraction of the beam at each energy, summed over the elements of the sample. As for fluorescence, the beam and the scattered x-rays are attenuated by the whole sample (muS = sum of C_i * mu_i), not by each scattering element alone, so a single infinitely thick layer in emission_layered gives the same result.
+
+# In[ ]:
+
+def rayleigh_coeff(Z_arr, C_arr, energies, phi_in, phi_out):
     sin_phi1 = np.sin(np.radians(phi_in))
     sin_phi2 = np.sin(np.radians(phi_out))
     theta = np.radians((180 - phi_in - phi_out))
     
     ## Values from xraylib ##
-    muE = xraylib.CS_Total(Z_arr, beam[:,0])  ## [Z,E]
-    sigmaRE = xraylib.DCS_Rayl(Z_arr, beam[:,0], np.array([theta]))  ## [Z,E,theta]
-    
-    for i,_ in enumerate(Z_arr):
-        Ra_arr = ((1.0/sin_phi1) * C_arr[i] * sigmaRE[i,:,0] *
-                  div_nDa(1.0, ((muE[i,:]/sin_phi1)+(muE[i,:]/sin_phi2))))
-        rayleigh[:,1] = rayleigh[:,1] + (beam[:,1] * Ra_arr[:])
+    muE = cache.CS_Total(Z_arr, energies)  ## [Z,E]
+    sigmaRE = cache.DCS_Rayl(Z_arr, energies, np.array([theta]))  ## [Z,E,theta]
     
-    return rayleigh
+    ## muS is mass attenuation coefficient for sample ##
+    muS = np.dot(C_arr, muE)
+    mu_sum = (muS/sin_phi1) + (muS/sin_phi2)
+    return (1.0/sin_phi1) * np.dot(C_arr, sigmaRE[:,:,0]) * div_aDa(np.ones_like(mu_sum), mu_sum)
+
+
+# In[ ]:
+
+def rayleigh_bulk_counts(Z_arr, C_arr, energies, counts, phi_in, phi_out, out=None):
+    Ra = rayleigh_coeff(Z_arr, C_arr, energies, phi_in, phi_out)
+    return np.multiply(counts, Ra, out=out)
 
 
 # In[53]:
 
-@jit
 def compton_bulk(Z_arr, C_arr, beam, phi_in, phi_out):
-    compton_E = np.copy(beam)
-    compton_E[:,1] = 0
+    compton = np.copy(beam)
+    compton_bulk_counts(Z_arr, C_arr, beam[:,0], beam[:,1], phi_in, phi_out, out=compton[:,1])
+    return compton
+
+
+# Scattered fraction of the beam at each incident energy, and the Compton-shifted energy it is detected at. Attenuation uses the sample's muS at E in and at the shifted energy out, as in rayleigh_coeff.
+
+# In[ ]:
+
+def compton_coeff(Z_arr, C_arr, energies, phi_in, phi_out):
     sin_phi1 = np.sin(np.radians(phi_in))
     sin_phi2 = np.sin(np.radians(phi_out))
     theta = np.radians((180.0 - phi_in - phi_out))
     
     ## Values from xraylib ##
-    EC = xraylib.ComptonEnergy(beam[:,0], np.array([theta]))  ## [E,theta]
-    muE = xraylib.CS_Total(Z_arr, beam[:,0])  ## [Z,E]
-    muEC = xraylib.CS_Total(Z_arr, EC[:,0])  ## [Z,E]
-    sigmaCE = xraylib.DCS_Compt(Z_arr, beam[:,0], np.array([theta]))  ## [Z,E,theta]
+    EC = cache.ComptonEnergy(energies, np.array([theta]))  ## [E,theta]
+    muE = cache.CS_Total(Z_arr, energies)  ## [Z,E]
+    muEC = cache.CS_Total(Z_arr, EC[:,0])  ## [Z,E]
+    sigmaCE = cache.DCS_Compt(Z_arr, energies, np.array([theta]))  ## [Z,E,theta]
     
-    for i,_ in enumerate(Z_arr):
-        Co_arr = ((1.0/sin_phi1) * C_arr[i] * sigmaCE[i,:,0] *
-                  div_nDa(1.0/((muE[i,:]/sin_phi1)+(muEC[i,:]/sin_phi2))))
-        compton_E[:,1] = compton_E[:,1] + (beam[:,1] * Co_arr[:])
-    
-    compton = compton_shift(compton_E, EC[:,0])
-    return compton
+    muS = np.dot(C_arr, muE)
+    muS_C = np.dot(C_arr, muEC)
+    mu_sum = (muS/sin_phi1) + (muS_C/sin_phi2)
+    return (1.0/sin_phi1) * np.dot(C_arr, sigmaCE[:,:,0]) * div_aDa(np.ones_like(mu_sum), mu_sum), EC[:,0]
+
+
+# In[ ]:
+
+def compton_bulk_counts(Z_arr, C_arr, energies, counts, phi_in, phi_out, out=None, split=False):
+    Co, EC = compton_coeff(Z_arr, C_arr, energies, phi_in, phi_out)
+    Co *= counts
+    if out is None:
+        out = np.zeros(len(counts))
+    out[:] = 0
+    return binning.bin_counts_add(EC, Co, energies, out, split)
 
 
 # ## Main Function to Call
 
 # In[54]:
 
-@jit
-def emission_bulk(Z_arr, C_arr, beam, phi_in, phi_out):
-    fluor = fluor_K_bulk(Z_arr, C_arr, beam, phi_in, phi_out)
-    rayleigh = rayleigh_bulk(Z_arr, C_arr, beam, phi_in, phi_out)
-    compton = compton_bulk(Z_arr, C_arr, beam, phi_in, phi_out)
-    total = np.copy(fluor)
-    total[:,1] = fluor[:,1] + rayleigh[:,1] + compton[:,1]
+def emission_bulk(Z_arr, C_arr, beam, phi_in, phi_out, shells=None):
+    total = np.copy(beam)
+    emission_bulk_counts(Z_arr, C_arr, beam[:,0], beam[:,1], phi_in, phi_out, shells, out=total[:,1])
     return total
 
+
+# Counts-only form of emission_bulk. The scattered counts are taken from the beam before out is written, so out may be the beam counts array itself.
+
+# In[ ]:
+
+def emission_bulk_counts(Z_arr, C_arr, energies, counts, phi_in, phi_out, shells=None, out=None):
+    Ra = rayleigh_coeff(Z_arr, C_arr, energies, phi_in, phi_out)
+    Ra *= counts
+    Co, EC = compton_coeff(Z_arr, C_arr, energies, phi_in, phi_out)
+    Co *= counts
+    if shells is None:
+        out = fluor_K_bulk_counts(Z_arr, C_arr, energies, counts, phi_in, phi_out, out=out)
+    else:
+        out = fluor_bulk_counts(Z_arr, C_arr, energies, counts, phi_in, phi_out, shells, out=out)
+    out += Ra
+    return binning.bin_counts_add(EC, Co, energies, out, False)
+
+
+# ## Layered Samples
+
+# layers is a list of dicts from the top of the sample down, each {'Z': Z_arr, 'C': C_arr, 'rho': g/cm3, 't': cm}, with t = np.inf for an infinitely thick base (e.g. water film over sediment, or liner over core). Each layer emits primary fluorescence and Rayleigh and Compton scatter from its own thickness, attenuated on the way in and out by the layers above it. Secondary fluorescence is not included. Within each layer, scatter is attenuated by the layer's total mu/rho, as in rayleigh_coeff and compton_coeff, so one infinitely thick layer reproduces emission_bulk without secondary fluorescence. mu/rho comes from mu_table (xray_tables.get_mu_table) when given, otherwise from the xraylib cache, and is looked up once for all elements of all layers. Arrays are [layer, line, E] or [layer, E], so all layers are evaluated together.
+
+# In[ ]:
+
+## (1 - exp(-rho_t*chi))/chi, which is 1/chi for an infinitely thick layer ##
+def layer_depth_factor(rho_t, chi):
+    rho_t_chi = rho_t * np.where(chi > 0, chi, 1.0)
+    absorbed = np.where(chi > 0, -np.expm1(-rho_t_chi), 0.0)
+    return div_aDa(absorbed, chi)
+
+
+# In[ ]:
+
+## sum of rho*t*mu/sin(phi) over the layers above each layer, only the base may be infinite ##
+def attenuation_above(rho_t, muS, sin_phi):
+    above = np.zeros_like(muS)
+    above[1:,:] = np.cumsum(rho_t[:-1] * muS[:-1,:] / sin_phi, axis=0)
+    return above
+
+
+# In[ ]:
+
+def emission_layered(layers, beam, phi_in, phi_out, shells=('K', 'L1', 'L2', 'L3'), mu_table=None):
+    sin_phi1 = np.sin(np.radians(phi_in))
+    sin_phi2 = np.sin(np.radians(phi_out))
+    theta = np.radians((180.0 - phi_in - phi_out))
+    energies = beam[:,0]
+    
+    ## Compositions of all layers over the union of their elements ##
+    Z_all = np.unique(np.concatenate([np.asarray(layer['Z']) for layer in layers]))
+    C_layers = np.zeros(shape=(len(layers), len(Z_all)))
+    for n, layer in enumerate(layers):
+        C_layers[n, np.searchsorted(Z_all, layer['Z'])] = layer['C']
+    rho_t = np.array([layer['rho'] * layer['t'] for layer in layers])[:,np.newaxis]
+    
+    ## Values from xraylib ##
+    line_tables = fluor_tables(Z_all, energies, shells, mu_table)
+    EC = cache.ComptonEnergy(energies, np.array([theta]))[:,0]
+    sigmaRE = cache.DCS_Rayl(Z_all, energies, np.array([theta]))[:,:,0]  ## [Z,E]
+    sigmaCE = cache.DCS_Compt(Z_all, energies, np.array([theta]))[:,:,0]  ## [Z,E]
+    if mu_table is None:
+        muEC = cache.CS_Total(Z_all, EC)
+    else:
+        muEC = mu_tables.interp_mu(mu_table, Z_all, EC)
+    
+    ## muS[n,E] is mass attenuation coefficient of layer n ##
+    muS = np.dot(C_layers, line_tables['mu'])
+    muS_C = np.dot(C_layers, muEC)
+    above_in = attenuation_above(rho_t, muS, sin_phi1)
+    above_out = attenuation_above(rho_t, muS, sin_phi2)
+    above_out_C = attenuation_above(rho_t, muS_C, sin_phi2)
+    beam_in = beam[np.newaxis,:,1] * np.exp(-above_in)  ## [layer,E]
+    
+    ## Primary fluorescence, [layer,line,E] ##
+    el = line_tables['el']
+    row = line_tables['row']
+    tau = line_tables['tau'][el,:]
+    eps = div_aDa(line_tables['sigma'], tau) * line_tables['w'][:,np.newaxis]
+    chi = (muS / sin_phi1)[:,np.newaxis,:] + (muS[:,row] / sin_phi2)[:,:,np.newaxis]
+    depth = layer_depth_factor(rho_t[:,:,np.newaxis], chi)
+    P_arr = (1.0/(4.0*np.pi)) * (1.0/sin_phi1) * C_layers[:,el][:,:,np.newaxis] * (eps * tau)[np.newaxis,:,:] * depth
+    lines = np.sum(beam_in[:,np.newaxis,:] * P_arr, axis=2) * np.exp(-above_out[:,row])  ## [layer,line]
+    
+    ## Rayleigh and Compton scatter, [layer,E] ##
+    chi_R = muS / sin_phi1 + muS / sin_phi2
+    rayleigh = ((1.0/sin_phi1) * np.dot(C_layers, sigmaRE) * beam_in *
+                layer_depth_factor(rho_t, chi_R) * np.exp(-above_out))
+    chi_C = muS / sin_phi1 + muS_C / sin_phi2
+    compton_E = ((1.0/sin_phi1) * np.dot(C_layers, sigmaCE) * beam_in *
+                 layer_depth_factor(rho_t, chi_C) * np.exp(-above_out_C))
+    
+    total = np.copy(beam)
+    total[:,1] = (np.bincount(row, weights=np.sum(lines, axis=0), minlength=len(beam)) +
+                  np.sum(rayleigh, axis=0) +
+                  binning.bin_counts(EC, np.sum(compton_E, axis=0), energies, False))
+    return total
@@ -0,0 +1,218 @@
+
+# coding: utf-8
+
+# # Fitting Compositions to Emission Spectra
+#
+# Recovers C_arr from a measured spectrum by bounded least squares on the emission_bulk model, using an analytic Jacobian with respect to C_arr.
+#
+# prepare_model() does every composition-independent step once: the xraylib lookups, the per-line fluorescence terms, and the Rayleigh and Compton spectra of each element, which are linear in C_arr. Each optimiser iteration then only rebuilds the sample attenuation and the terms that depend on it.
+#
+# Fluorescence follows fluor_from_tables. With muS = C . mu and D[i,E] = muS[E]/sin_phi1 + muS[Ei]/sin_phi2:
+#   primary[i]   = sum_E beam * k * C_i * eps_i * tau_i / D[i,E]
+#   secondary[i] = sum_j H[i,j] * (L1[i,j] * X[i,j] + Y[i,j])
+# with H = h/muS[Ej], L1 = phi(muS[Ei]/(sin_phi2*muS[Ej])), L2 = phi(muS[E]/(sin_phi1*muS[Ej])), phi(x) = ln(1+x)/x, X = AG . F and Y = AG . (F*L2). The Jacobian is the product-rule derivative of these terms.
+
+# ## Imports
+
+# In[1]:
+
+import numpy as np
+import scipy.optimize as optimize
+import xray_emission as emis
+from xray_emission import div_aDa
+
+
+# ## Support Functions
+
+# In[2]:
+
+def inv(arr):
+    return div_aDa(np.ones_like(arr), arr)
+
+
+# In[3]:
+
+## phi(x) = ln(1+x)/x and its derivative, with the x -> 0 limits ##
+def calc_phi(x):
+    small = x < 1e-6
+    xs = np.where(small, 1.0, x)
+    phi = np.where(small, 1.0 - x/2.0, np.log(1.0 + xs)/xs)
+    dphi = np.where(small, -0.5 + 2.0*x/3.0, (xs/(1.0 + xs) - np.log(1.0 + xs))/(xs**2))
+    return phi, dphi
+
+
+# In[4]:
+
+## As in fluor_from_tables, the last line written to a channel wins ##
+def last_in_row(rows):
+    _, first_rev = np.unique(rows[::-1], return_index=True)
+    last = len(rows) - 1 - first_rev
+    return last
+
+
+# ## Composition-Independent Terms
+
+# In[5]:
+
+def prepare_model(Z_arr, beam, phi_in, phi_out, response=None):
+    n_Z = len(Z_arr)
+    sin_phi1 = np.sin(np.radians(phi_in))
+    sin_phi2 = np.sin(np.radians(phi_out))
+    tables = emis.fluor_K_tables(Z_arr, beam[:,0])
+    el = tables['el']
+    row = tables['row']
+    sigma = tables['sigma']
+    tau = tables['tau'][el,:]
+    eps = div_aDa(sigma, tau) * tables['w'][:,np.newaxis]
+
+    ## Rayleigh and Compton spectra per unit concentration of each element ##
+    scatter = np.zeros(shape=(n_Z, len(beam)))
+    for i in range(n_Z):
+        C_unit = np.zeros(n_Z)
+        C_unit[i] = 1.0
+        scatter[i,:] = (emis.rayleigh_bulk(Z_arr, C_unit, beam, phi_in, phi_out)[:,1] +
+                        emis.compton_bulk(Z_arr, C_unit, beam, phi_in, phi_out)[:,1])
+
+    model = {'n_Z': n_Z, 'n_E': len(beam), 'sin_phi1': sin_phi1, 'sin_phi2': sin_phi2,
+             'el': el, 'row': row, 'last': last_in_row(row), 'mu': tables['mu'],
+             'A0_num': beam[np.newaxis,:,1] * (1.0/(4.0*np.pi)) * (1.0/sin_phi1) * eps * tau,
+             'G': inv(sigma * tau),
+             'F0': (1.0/2.0) * eps * tau,
+             'h': sigma[:,row] * tau[:,row],
+             'mask': ((el[:,np.newaxis] != el[np.newaxis,:]) &
+                      (tables['id'][:,np.newaxis] != tables['id'][np.newaxis,:])),
+             'scatter': scatter, 'response': response}
+    return model
+
+
+# ## Fluorescence and its Jacobian
+
+# In[6]:
+
+def fluor_lines_jacobian(C_arr, model):
+    s1 = model['sin_phi1']
+    s2 = model['sin_phi2']
+    el = model['el']
+    row = model['row']
+    mu = model['mu']  ## [Z,E]
+    mask = model['mask']
+    n_lines = len(el)
+    n_Z = model['n_Z']
+    C_line = C_arr[el][:,np.newaxis]
+    delta_el = (el[:,np.newaxis] == np.arange(n_Z)[np.newaxis,:]).astype(float)  ## [line,Z]
+
+    muS = np.dot(C_arr, mu)
+    muS_j = muS[row]
+    inv_muS_j = inv(muS_j)
+    mu_row = mu[:,row].T  ## mu[l,E_i] as [line,Z]
+
+    ## Primary ##
+    D = (muS / s1)[np.newaxis,:] + (muS[row] / s2)[:,np.newaxis]
+    inv_D = inv(D)
+    A0 = model['A0_num'] * inv_D
+    A_arr = C_line * A0
+    primary = np.sum(A_arr, axis=1)
+    Q_arr = A0 * inv_D
+    d_primary = (delta_el * np.sum(A0, axis=1)[:,np.newaxis] -
+                 C_line * (np.dot(Q_arr, mu.T) / s1 + np.sum(Q_arr, axis=1)[:,np.newaxis] * mu_row / s2))
+
+    ## Secondary ##
+    G = model['G']
+    A0G = A0 * G
+    AG = C_line * A0G
+    QG = Q_arr * G
+    F0 = model['F0']
+    F_arr = C_line * F0
+    H_arr = model['h'] * inv_muS_j[np.newaxis,:]
+    u = (muS[row] / s2)[:,np.newaxis] * inv_muS_j[np.newaxis,:]
+    L1, dphi_u = calc_phi(u)
+    v = (muS / s1)[np.newaxis,:] * inv_muS_j[:,np.newaxis]
+    L2, dphi_v = calc_phi(v)
+    FL2 = F_arr * L2
+    X_arr = np.dot(AG, F_arr.T)
+    Y_arr = np.dot(AG, FL2.T)
+    secondary = np.sum(np.where(mask, H_arr * (L1 * X_arr + Y_arr), 0.0), axis=1)
+
+    ## d/dC_l of X and Y, as [i,j,l] ##
+    def d_sum(F_b, F0_b):
+        F_mu = (F_b[:,np.newaxis,:] * mu[np.newaxis,:,:]).reshape(n_lines*n_Z, -1)
+        d_AG = (delta_el[:,np.newaxis,:] * np.dot(A0G, F_b.T)[:,:,np.newaxis] -
+                C_line[:,:,np.newaxis] * (np.dot(QG, F_mu.T).reshape(n_lines, n_lines, n_Z) / s1 +
+                                          np.dot(QG, F_b.T)[:,:,np.newaxis] * (mu_row / s2)[:,np.newaxis,:]))
+        d_F = np.dot(AG, F0_b.T)[:,:,np.newaxis] * delta_el[np.newaxis,:,:]
+        return d_AG + d_F
+    dX = d_sum(F_arr, F0)
+    dY = d_sum(FL2, F0 * L2)
+    F_dphi = F_arr * dphi_v
+    F_dphi_mu = (F_dphi[:,np.newaxis,:] * mu[np.newaxis,:,:]).reshape(n_lines*n_Z, -1)
+    dY = dY + (np.dot(AG, F_dphi_mu.T).reshape(n_lines, n_lines, n_Z) * (inv_muS_j / s1)[np.newaxis,:,np.newaxis] -
+               np.dot(AG, (F_dphi * v).T)[:,:,np.newaxis] * (mu_row * inv_muS_j[:,np.newaxis])[np.newaxis,:,:])
+
+    dH = -(H_arr * inv_muS_j[np.newaxis,:])[:,:,np.newaxis] * mu_row[np.newaxis,:,:]
+    du = ((mu_row / s2)[:,np.newaxis,:] * inv_muS_j[np.newaxis,:,np.newaxis] -
+          (u * inv_muS_j[np.newaxis,:])[:,:,np.newaxis] * mu_row[np.newaxis,:,:])
+    dL1 = dphi_u[:,:,np.newaxis] * du
+    d_sec = (dH * (L1 * X_arr + Y_arr)[:,:,np.newaxis] +
+             H_arr[:,:,np.newaxis] * (dL1 * X_arr[:,:,np.newaxis] + L1[:,:,np.newaxis] * dX + dY))
+    d_secondary = np.sum(np.where(mask[:,:,np.newaxis], d_sec, 0.0), axis=1)
+
+    return primary + secondary, d_primary + d_secondary
+
+
+# ## Model Spectrum and Jacobian
+
+# In[7]:
+
+def model_jacobian(C_arr, model):
+    C_arr = np.asarray(C_arr, dtype=float)
+    lines, d_lines = fluor_lines_jacobian(C_arr, model)
+    last = model['last']
+    rows = model['row'][last]
+
+    counts = np.dot(C_arr, model['scatter'])
+    jac = np.copy(model['scatter'].T)  ## [E,Z]
+    counts[rows] = counts[rows] + lines[last]
+    jac[rows,:] = jac[rows,:] + d_lines[last,:]
+    if model['response'] is not None:
+        counts = model['response'].dot(counts)
+        jac = model['response'].dot(jac)
+    return counts, jac
+
+
+# In[8]:
+
+def model_spectrum(C_arr, model):
+    counts, _ = model_jacobian(C_arr, model)
+    return counts
+
+
+# ## Main Function to Call
+
+# Fits C_arr (each bounded to [0, 1] by default) to measured counts on the model grid, or on the detector channels when a response matrix from xray_detection was given to prepare_model. scale converts model units to measured counts (solid angle, live time, tube current). Residuals are weighted by 1/sqrt(counts) unless weights are given.
+
+# In[9]:
+
+def fit_composition(measured, model, C0=None, scale=1.0, weights=None, bounds=(0.0, 1.0), **kwargs):
+    if C0 is None:
+        C0 = np.full(model['n_Z'], 1.0 / model['n_Z'])
+    if weights is None:
+        weights = 1.0 / np.sqrt(np.maximum(measured, 1.0))
+
+    cached = {}
+    def evaluate(C_arr):
+        key = C_arr.tobytes()
+        if cached.get('key') != key:
+            counts, jac = model_jacobian(C_arr, model)
+            cached.update({'key': key, 'counts': counts, 'jac': jac})
+        return cached['counts'], cached['jac']
+
+    def residuals(C_arr):
+        counts, _ = evaluate(C_arr)
+        return weights * (scale * counts - measured)
+
+    def jacobian(C_arr):
+        _, jac = evaluate(C_arr)
+        return (weights * scale)[:,np.newaxis] * jac
+
+    result = optimize.least_squares(residuals, C0, jac=jacobian, bounds=bounds, **kwargs)
+    return result
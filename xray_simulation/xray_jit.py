@@ -0,0 +1,88 @@
+
+# coding: utf-8
+
+# # Compiled Kernels and Warm Start
+#
+# The numeric kernels in the simulation modules are compiled in nopython mode with cache=True, so compiled machine code is written next to the sources (or to NUMBA_CACHE_DIR if set) and later processes load it instead of recompiling. The xraylib lookups stay in plain Python wrappers that call these kernels.
+#
+# warm_start() calls each kernel once with representative float64 arguments, which loads (or on the first run, compiles and saves) its machine code, and reports the time taken and whether it was compiled, loaded from the on-disk cache or already in memory.
+
+# ## Imports
+
+# In[1]:
+
+import time
+import numpy as np
+import xray_emission as emis
+import xray_detection as det
+import xray_attenuation as att
+import xray_source as src
+import xray_binning as binning
+
+
+# ## Representative Arguments
+
+# In[2]:
+
+def kernel_calls():
+    energies = np.arange(1.0, 41.96, 0.02)
+    spec = np.column_stack((energies, np.ones(len(energies))))
+    char = np.array([[6.4, 1.0], [7.06, 0.2]])
+    kVp_grid = np.full((1,1,1), 30.0)
+    calls = [
+        ('xray_binning.energy_rows', binning.energy_rows, (char[:,0], energies)),
+        ('xray_binning.bin_counts', binning.bin_counts, (char[:,0], char[:,1], energies, False)),
+        ('xray_binning.bin_counts', binning.bin_counts, (energies, spec[:,1], energies, False)),
+        ('xray_binning.bin_counts_add', binning.bin_counts_add, (char[:,0], char[:,1], energies, np.zeros(len(energies)), False)),
+        ('xray_emission.calc_Erow', emis.calc_Erow, (6.4, energies)),
+        ('xray_emission.compton_shift', emis.compton_shift, (spec, energies, False)),
+        ('xray_detection.gaussian_noise', det.gaussian_noise, (energies, 6.4, 0.1)),
+        ('xray_detection.csr_dot', det.csr_dot, (np.arange(len(energies)+1), np.arange(len(energies)), energies, energies, np.zeros(len(energies)))),
+        ('xray_attenuation.attenuate', att.attenuate, (spec, energies, 1.0)),
+        ('xray_attenuation.attenuate_counts', att.attenuate_counts, (energies, energies, 1.0, np.zeros(len(energies)), np.zeros(len(energies)))),
+        ('xray_attenuation.attenuate_path_counts', att.attenuate_path_counts, (energies, np.array([[1.0, 1.0]]), spec, np.zeros(len(energies)), np.zeros(len(energies)))),
+        ('xray_attenuation.calc_omega_cone', att.calc_omega_cone, (1.0, 10.0)),
+        ('xray_attenuation.calc_omega_pyramid', att.calc_omega_pyramid, (1.0, 1.0, 10.0)),
+        ('xray_source.calc_pz_bar', src.calc_pz_bar, (45, 102.9, 30.0, energies)),
+        ('xray_source.calc_pz_bar', src.calc_pz_bar, (45, 102.9, 30.0, 23.2)),
+        ('xray_source.calc_pz_bar', src.calc_pz_bar, (45, 102.9, kVp_grid, energies)),
+        ('xray_source.calc_absorption_from_pz', src.calc_absorption_from_pz, (energies, energies, 80.0, 10.0)),
+        ('xray_source.calc_stopping_factor', src.calc_stopping_factor, (45, 30.0, 23.2, 0)),
+        ('xray_source.calc_stopping_factor', src.calc_stopping_factor, (45, kVp_grid, 23.2, 0)),
+        ('xray_source.calc_backscatter_factor', src.calc_backscatter_factor, (45, 30.0, 23.2)),
+        ('xray_source.calc_backscatter_factor', src.calc_backscatter_factor, (45, kVp_grid, 23.2)),
+        ('xray_source.calc_Erow', src.calc_Erow, (6.4, energies)),
+        ('xray_source.merge_lines_continuum', src.merge_lines_continuum, (spec, char, False)),
+        ('xray_source.merge_lines_counts', src.merge_lines_counts, (energies, spec[:,1], char, np.zeros(len(energies)), False)),
+    ]
+    return calls
+
+
+# ## Main Function to Call
+
+# Returns {kernel name: {'seconds': time taken, 'source': 'compiled', 'disk cache' or 'memory'}}
+
+# In[3]:
+
+def warm_start(verbose=True):
+    report = {}
+    for name, kernel, args in kernel_calls():
+        n_sigs = len(kernel.signatures)
+        n_hits = sum(kernel.stats.cache_hits.values())
+        t0 = time.perf_counter()
+        kernel(*args)
+        seconds = time.perf_counter() - t0
+        if len(kernel.signatures) == n_sigs:
+            source = 'memory'
+        elif sum(kernel.stats.cache_hits.values()) > n_hits:
+            source = 'disk cache'
+        else:
+            source = 'compiled'
+        entry = report.setdefault(name, {'seconds': 0.0, 'source': source})
+        entry['seconds'] += seconds
+        if source == 'compiled':
+            entry['source'] = source
+    if verbose:
+        for name in report:
+            print("{:45s} {:8.3f} s  {:s}".format(name, report[name]['seconds'], report[name]['source']))
+    return report
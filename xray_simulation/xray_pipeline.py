@@ -0,0 +1,134 @@
+
+# coding: utf-8
+
+# # End-to-End Spectrum Simulation
+#
+# Runs source -> incoming path -> emission -> outgoing path -> detection for a list of samples, fanned out over a process pool. The setup shared by every sample is sent to each worker once when the worker starts, and results are streamed back in the order of the samples.
+#
+# setup = {'source': tube spectrum (xray_source.spectrum), 'phi_in': deg, 'phi_out': deg,
+#          'mu_rho_arr': from xray_attenuation.calc_mu_rho_arr (needed for paths),
+#          'offset_noise': keV, 'gain_noise': keV/keV (omit both to skip detection),
+#          'cache_path': npz file for xray_cache (optional),
+#          'warm_start': load compiled kernels when each worker starts (default True)}
+#
+# sample = {'Z': Z_arr, 'C': C_arr, 'path_in': [[t, mat], ...], 'path_out': [[t, mat], ...]}
+# 'path_in' and 'path_out' are optional, and a sample may override 'phi_in' and 'phi_out'.
+#
+# simulate_batch() runs the same chain in the calling process with the counts-only stages (see xray_spectrum), writing each result into a row of one preallocated batch buffer.
+
+# ## Imports
+
+# In[1]:
+
+import numpy as np
+import multiprocessing as mp
+import xray_attenuation as att
+import xray_emission as emis
+import xray_detection as det
+import xray_cache as cache
+import xray_spectrum as spec
+import xray_jit
+
+
+# ## Single Sample
+
+# In[2]:
+
+def simulate(sample, setup):
+    phi_in = sample.get('phi_in', setup['phi_in'])
+    phi_out = sample.get('phi_out', setup['phi_out'])
+    path_in = sample.get('path_in', [])
+    path_out = sample.get('path_out', [])
+
+    beam = setup['source']
+    if len(path_in) > 0:
+        beam, _ = att.attenuate_path(beam, path_in, setup['mu_rho_arr'])
+    emitted = emis.emission_bulk(sample['Z'], sample['C'], beam, phi_in, phi_out)
+    if len(path_out) > 0:
+        emitted, _ = att.attenuate_path(emitted, path_out, setup['mu_rho_arr'])
+    if ('offset_noise' in setup) and ('gain_noise' in setup):
+        return det.detected(emitted, setup['offset_noise'], setup['gain_noise'])
+    return emitted
+
+
+# ## Batches into Preallocated Buffers
+
+# work holds three counts buffers: the beam reaching the sample, the emitted spectrum, and the counts absorbed along a path
+
+# In[3]:
+
+def simulate_counts(sample, setup, energies, out, work):
+    phi_in = sample.get('phi_in', setup['phi_in'])
+    phi_out = sample.get('phi_out', setup['phi_out'])
+    path_in = sample.get('path_in', [])
+    path_out = sample.get('path_out', [])
+    beam, emitted, absorbed = work[0], work[1], work[2]
+
+    beam[:] = setup['source'][:,1]
+    if len(path_in) > 0:
+        att.attenuate_path_counts(beam, np.asarray(path_in, dtype=float), setup['mu_rho_arr'], beam, absorbed)
+    emis.emission_bulk_counts(sample['Z'], sample['C'], energies, beam, phi_in, phi_out, out=emitted)
+    if len(path_out) > 0:
+        att.attenuate_path_counts(emitted, np.asarray(path_out, dtype=float), setup['mu_rho_arr'], emitted, absorbed)
+    if ('offset_noise' in setup) and ('gain_noise' in setup):
+        return det.detected_counts(energies, emitted, setup['offset_noise'], setup['gain_noise'], out=out)
+    out[:] = emitted
+    return out
+
+
+# Returns (energies, counts[sample,E]). out may be a buffer from xray_spectrum.spectrum_batch that is reused between batches.
+
+# In[4]:
+
+def simulate_batch(samples, setup, out=None):
+    energies = spec.energy_grid(setup['source'][:,0])
+    if out is None:
+        _, out = spec.spectrum_batch(energies, len(samples))
+    work = np.zeros(shape=(3, len(energies)))
+    for k, sample in enumerate(samples):
+        simulate_counts(sample, setup, energies, out[k], work)
+    return energies, out
+
+
+# ## Worker Processes
+
+# Each worker keeps its own copy of the setup, xraylib cache and compiled kernels for its whole lifetime, so the per-sample cost is only the simulation itself. Kernels are loaded from numba's on-disk cache when the worker starts (see xray_jit).
+
+# In[5]:
+
+worker_setup = {}
+
+
+# In[6]:
+
+def init_worker(setup):
+    worker_setup.clear()
+    worker_setup.update(setup)
+    if setup.get('cache_path') is not None:
+        cache.load(setup['cache_path'])
+    if setup.get('warm_start', True):
+        xray_jit.warm_start(verbose=False)
+    return None
+
+
+# In[7]:
+
+def simulate_in_worker(sample):
+    return simulate(sample, worker_setup)
+
+
+# ## Main Function to Call
+
+# Generator yielding one simulated spectrum per sample, in order. processes=1 runs in the calling process.
+
+# In[8]:
+
+def simulate_many(samples, setup, processes=None, chunksize=8):
+    if processes == 1:
+        init_worker(setup)
+        for sample in samples:
+            yield simulate_in_worker(sample)
+        return
+    with mp.Pool(processes, initializer=init_worker, initargs=(setup,)) as pool:
+        for result in pool.imap(simulate_in_worker, samples, chunksize):
+            yield result
@@ -11,6 +11,8 @@
 
 import numpy as np
 import xraylib_np as xray
+import xray_cache as cache
+import xray_binning as binning
 from numba import jit
 
 
@@ -19,35 +21,50 @@ from numba import jit
 # In[323]:
 
 ## (1-exp(-tau*pz*angle_ratio))/(tau*pz*angle_ratio) in continuum and characteristic ##
-@jit
-def calc_absorption_factor(Z, kVp, theta_in, theta_out, keV_pz, keV_tau): ##
-    Zarr = np.array([Z])
+@jit(nopython=True, cache=True)
+def calc_pz_bar(Z, A, kVp, keV_pz):
     U0 = kVp / keV_pz
     
     m = 0.1382 - (0.9211 / np.sqrt(Z))
     J = 0.0135*Z
     n = (kVp**m)*(0.1904 - 0.2236*np.log(Z) + 
                   0.1292*(np.log(Z)**2) - 0.0149*(np.log(Z)**3))
-    Aarr = xray.AtomicWeight(Zarr)
-    A = Aarr[0]
     pz_m = (A/Z)*((0.787*(10**-5))*np.sqrt(J)*(kVp**(3/2)) + (0.735*(10**-6))*(kVp**2))
     pz_num = 0.49269 - 1.0987*n + 0.78557*(n**2)
     pz_den = 0.70256 - 1.09865*n + 1.0046*(n**2)
     
     pz_bar = pz_m*(pz_num/(pz_den + np.log(U0)))*np.log(U0)
-    tauE = xray.CS_Photo(Zarr, keV_tau)
-    tauE = tauE[0,:]
+    return pz_bar
+
+
+# In[ ]:
+
+@jit(nopython=True, cache=True)
+def calc_absorption_from_pz(tauE, pz_bar, theta_in, theta_out):
     angle_ratio = np.sin(np.radians(theta_in))/np.sin(np.radians(theta_out))
     absorption_term = tauE * 2 * pz_bar * angle_ratio
-    absorption_term = absorption_term.clip(min=0.00001)
+    absorption_term = np.maximum(absorption_term, 0.00001)
     absorption_factor = ((1-np.exp(-absorption_term))/absorption_term)
     return absorption_factor
 
 
+# In[ ]:
+
+def calc_absorption_factor(Z, kVp, theta_in, theta_out, keV_pz, keV_tau): ##
+    Zarr = np.array([Z])
+    Aarr = xray.AtomicWeight(Zarr)
+    A = Aarr[0]
+    pz_bar = calc_pz_bar(Z, A, kVp, keV_pz)
+    tauE = cache.CS_Photo(Zarr, keV_tau)
+    tauE = tauE[0,:]
+    absorption_factor = calc_absorption_from_pz(tauE, pz_bar, theta_in, theta_out)
+    return absorption_factor
+
+
 # In[324]:
 
 ## 1/Sjk in characteristic equation ##
-@jit
+@jit(nopython=True, cache=True)
 def calc_stopping_factor(Z, kVp, keV_edge, shell):
     U0 = kVp / keV_edge
     if shell == 0:
@@ -66,7 +83,7 @@ def calc_stopping_factor(Z, kVp, keV_edge, shell):
 # In[325]:
 
 ## R in characteristic equation ##
-@jit
+@jit(nopython=True, cache=True)
 def calc_backscatter_factor(Z, kVp, keV_edge):
     U0 = kVp / keV_edge
     R = 1 - 0.0081517*Z + (3.613*(10**-5))*(Z**2) + 0.009583*Z*np.exp(-U0) + 0.001141*kVp
@@ -77,7 +94,6 @@ def calc_backscatter_factor(Z, kVp, keV_edge):
 
 # In[326]:
 
-@jit
 def generate_continuum(Z, kVp, theta_in, theta_out, dE):
     Zarr = np.array([Z])
     keV = np.arange(1.0,(kVp + dE),dE)
@@ -100,7 +116,6 @@ def generate_continuum(Z, kVp, theta_in, theta_out, dE):
 
 # In[327]:
 
-@jit
 def generate_peaks_for_shell(Z, kVp, theta_in, theta_out, shell, lines):
     Zarr = np.array([Z])
     abs_edge_arr = xray.EdgeEnergy(Zarr, shell)
@@ -115,7 +130,7 @@ def generate_peaks_for_shell(Z, kVp, theta_in, theta_out, shell, lines):
     if (kVp > abs_edge):
         const = 6 * (10**13)
         abs_f = calc_absorption_factor(Z, kVp, theta_in, theta_out, abs_edge, line_keV)
-        stop_f = calc_stopping_factor(Z, kVp, abs_edge, shell)
+        stop_f = calc_stopping_factor(Z, kVp, abs_edge, shell[0])
         back_f = calc_backscatter_factor(Z, kVp, abs_edge)
         line_intensity = const * stop_f * back_f * fluor_yield * line_rate * abs_f
         peaks = np.column_stack((line_keV,line_intensity))
@@ -126,7 +141,6 @@ def generate_peaks_for_shell(Z, kVp, theta_in, theta_out, shell, lines):
 
 # In[328]:
 
-@jit
 def generate_K_peaks(Z, kVp, theta_in, theta_out):
     shell = np.array([xray.K_SHELL])
     lines = np.array([xray.KL3_LINE, xray.KL2_LINE, xray.KM3_LINE, xray.KM2_LINE])
@@ -136,7 +150,6 @@ def generate_K_peaks(Z, kVp, theta_in, theta_out):
 
 # In[329]:
 
-@jit
 def generate_L3_peaks(Z, kVp, theta_in, theta_out):
     shell = np.array([xray.L3_SHELL])
     lines = np.array([xray.L3M5_LINE, xray.L3M4_LINE])
@@ -146,7 +159,6 @@ def generate_L3_peaks(Z, kVp, theta_in, theta_out):
 
 # In[330]:
 
-@jit
 def generate_L2_peaks(Z, kVp, theta_in, theta_out):
     shell = np.array([xray.L2_SHELL])
     lines = np.array([xray.L2M4_LINE])
@@ -156,7 +168,6 @@ def generate_L2_peaks(Z, kVp, theta_in, theta_out):
 
 # In[331]:
 
-@jit
 def generate_L1_peaks(Z, kVp, theta_in, theta_out):
     shell = np.array([xray.L1_SHELL])
     lines = np.array([xray.L1M3_LINE, xray.L1M2_LINE])
@@ -168,7 +179,7 @@ def generate_L1_peaks(Z, kVp, theta_in, theta_out):
 
 # In[332]:
 
-@jit
+@jit(nopython=True, cache=True)
 def calc_Erow(Ei, energies):
     minE = energies[0]
     maxE = energies[len(energies)-1]
@@ -184,20 +195,28 @@ def calc_Erow(Ei, energies):
 
 # In[333]:
 
-@jit
-def merge_lines_continuum(cont, char):
+@jit(nopython=True, cache=True)
+def merge_lines_continuum(cont, char, split=False):
     tot = np.copy(cont)
-    for i,_ in enumerate(char):
-        Erow = calc_Erow(char[i,0], cont[:,0])
-        tot[Erow,1] = tot[Erow,1] + char[i,1]
+    merge_lines_counts(cont[:,0], cont[:,1], char, tot[:,1], split)
     return tot
 
 
+# Counts-only form: out receives the continuum counts plus the binned lines, and may be the continuum counts array itself
+
+# In[ ]:
+
+@jit(nopython=True, cache=True)
+def merge_lines_counts(energies, counts, char, out, split=False):
+    for i in range(len(counts)):
+        out[i] = counts[i]
+    return binning.bin_counts_add(char[:,0], char[:,1], energies, out, split)
+
+
 # ## Main Function to Call
 
 # In[334]:
 
-@jit
 def spectrum(Z, kVp, mA, s, theta_in, theta_out, dE):
     cont = generate_continuum(Z, kVp, theta_in, theta_out, dE)
     K_peaks = generate_K_peaks(Z, kVp, theta_in, theta_out)
@@ -209,3 +228,59 @@ def spectrum(Z, kVp, mA, s, theta_in, theta_out, dE):
     tot[:,1] = mA * s * tot[:,1]
     return tot
 
+
+
+# ## Sweep Over Tube Voltages and Take-Off Angles
+
+# Returns the shared energy grid (1 keV to the highest kVp in steps of dE) and a cube of spectra indexed [kVp, theta_out, E]. Atomic parameters and cross sections are looked up once for the whole grid. For each kVp, the cube matches spectrum() over that spectrum's energies and is zero above them. dtype=np.float32 stores the cube in single precision.
+
+# In[ ]:
+
+def spectrum_sweep(Z, kVp_arr, mA, s, theta_in, theta_out_arr, dE, dtype=np.float64):
+    Zarr = np.array([Z])
+    kVp = np.asarray(kVp_arr, dtype=float)[:,np.newaxis,np.newaxis]
+    theta_out = np.asarray(theta_out_arr, dtype=float)[np.newaxis,:,np.newaxis]
+    keV = np.arange(1.0,(np.max(kVp) + dE),dE)
+    A = xray.AtomicWeight(Zarr)[0]
+    
+    ## Continuum ##
+    const = 1.35 * (10**9)
+    x = 1.109 - 0.00435*Z + 0.00175*kVp
+    U0 = kVp / keV
+    Udiff = U0 - 1
+    Udiff[Udiff < 0] = 0
+    Ibasic = const * Z * (Udiff**x) * dE
+    tauE = cache.CS_Photo(Zarr, keV)[0,:]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pz_bar = calc_pz_bar(Z, A, kVp, keV)
+        absorption_factor = calc_absorption_from_pz(tauE, pz_bar, theta_in, theta_out)
+    cube = np.where(Udiff > 0, Ibasic * absorption_factor, 0.0)
+    
+    ## Characteristic peaks, shell by shell ##
+    shell_lines = [(xray.K_SHELL, [xray.KL3_LINE, xray.KL2_LINE, xray.KM3_LINE, xray.KM2_LINE]),
+                   (xray.L3_SHELL, [xray.L3M5_LINE, xray.L3M4_LINE]),
+                   (xray.L2_SHELL, [xray.L2M4_LINE]),
+                   (xray.L1_SHELL, [xray.L1M3_LINE, xray.L1M2_LINE])]
+    for shell_id, line_ids in shell_lines:
+        shell = np.array([shell_id])
+        lines = np.array(line_ids)
+        abs_edge = xray.EdgeEnergy(Zarr, shell)[0,0]
+        fluor_yield = xray.FluorYield(Zarr, shell)[0,0]
+        line_keV = xray.LineEnergy(Zarr, lines)[0,:]
+        line_rate = xray.RadRate(Zarr, lines)[0,:]
+        tau_line = cache.CS_Photo(Zarr, line_keV)[0,:]
+        excited = (kVp > abs_edge)
+        if np.any(excited) == False:
+            continue
+        kVp_ex = np.where(excited, kVp, 2*abs_edge)
+        const = 6 * (10**13)
+        abs_f = calc_absorption_from_pz(tau_line, calc_pz_bar(Z, A, kVp_ex, abs_edge), theta_in, theta_out)
+        stop_f = calc_stopping_factor(Z, kVp_ex, abs_edge, shell_id)
+        back_f = calc_backscatter_factor(Z, kVp_ex, abs_edge)
+        line_intensity = const * stop_f * back_f * fluor_yield * line_rate * abs_f
+        line_intensity = np.where(excited, line_intensity, 0.0)
+        rows = binning.energy_rows(line_keV, keV)
+        np.add.at(cube, (slice(None), slice(None), rows), line_intensity)
+    
+    cube = (mA * s * cube).astype(dtype, copy=False)
+    return keV, cube
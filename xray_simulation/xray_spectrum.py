@@ -0,0 +1,142 @@
+
+# coding: utf-8
+
+# # Spectra with a Shared Energy Axis
+#
+# The simulation functions pass spectra as (N,2) float64 arrays of [energy, counts]. For batches, the energy axis can instead be held once as a read-only float64 grid, and the counts kept separately, optionally in float32. The batch stages (xray_detection.detected_stack and detected_calibrated, xray_attenuation.attenuate_paths and transmitted_totals, xray_source.spectrum_sweep) take a dtype argument for this. compare_precision() runs a stage in both precisions and reports how far float32 deviates from float64, so the choice can be made per workflow.
+#
+# A Spectrum holds the shared grid and one counts buffer. Every stage has a counts-only form taking (energies, counts, ..., out=None) that writes into out instead of copying the (N,2) array, so a pipeline can run through a few preallocated buffers:
+#
+#     xray_attenuation.attenuate_counts, attenuate_path_counts
+#     xray_emission.fluor_K_bulk_counts, fluor_bulk_counts, rayleigh_bulk_counts, compton_bulk_counts, emission_bulk_counts
+#     xray_detection.detected_counts
+#     xray_source.merge_lines_counts
+#
+# All of them except detected_counts accept out = counts for in-place updates.
+
+# ## Imports
+
+# In[1]:
+
+import time
+import numpy as np
+from collections import namedtuple
+
+
+# ## Splitting and Joining [energy, counts] Arrays
+
+# In[2]:
+
+def energy_grid(energies):
+    if isinstance(energies, np.ndarray) and (energies.dtype == np.float64) and (energies.flags.writeable == False):
+        return energies
+    grid = np.array(energies, dtype=np.float64)
+    grid.flags.writeable = False
+    return grid
+
+
+# In[3]:
+
+def split_spectrum(spec, dtype=np.float64):
+    energies = energy_grid(spec[:,0])
+    counts = np.array(spec[:,1], dtype=dtype)
+    return energies, counts
+
+
+# In[4]:
+
+def join_spectrum(energies, counts):
+    spec = np.zeros(shape=(len(energies), 2), dtype=np.float64)
+    spec[:,0] = energies
+    spec[:,1] = counts
+    return spec
+
+
+# ## Spectrum Container
+
+# The energies of a Spectrum are never copied: spectra made with new_spectrum or like_spectrum share the grid object
+
+# In[5]:
+
+Spectrum = namedtuple('Spectrum', ['energies', 'counts'])
+
+
+# In[6]:
+
+def new_spectrum(energies, dtype=np.float64):
+    energies = energy_grid(energies)
+    return Spectrum(energies, np.zeros(len(energies), dtype=dtype))
+
+
+# In[7]:
+
+def like_spectrum(spectrum, dtype=None):
+    dtype = spectrum.counts.dtype if dtype is None else dtype
+    return Spectrum(spectrum.energies, np.zeros(len(spectrum.energies), dtype=dtype))
+
+
+# In[8]:
+
+def as_spectrum(spec, dtype=np.float64):
+    return Spectrum(*split_spectrum(spec, dtype))
+
+
+# In[9]:
+
+def to_array(spectrum):
+    return join_spectrum(spectrum.energies, spectrum.counts)
+
+
+# A batch buffer is one (n_spectra, n_channels) counts array; each row can be passed as out to a stage
+
+# In[10]:
+
+def spectrum_batch(energies, n_spectra, dtype=np.float64):
+    energies = energy_grid(energies)
+    return energies, np.zeros(shape=(n_spectra, len(energies)), dtype=dtype)
+
+
+# ## Precision Checks
+
+# Relative deviations are taken against max(|ref|, floor * max|ref|), so that near-empty channels do not dominate
+
+# In[11]:
+
+def max_rel_deviation(ref, test, floor=1e-6):
+    ref = np.asarray(ref, dtype=np.float64)
+    test = np.asarray(test, dtype=np.float64)
+    scale = np.maximum(np.abs(ref), floor * np.max(np.abs(ref)))
+    dev = div_or_zero(np.abs(test - ref), scale)
+    return float(np.max(dev)) if dev.size > 0 else 0.0
+
+
+# In[12]:
+
+def div_or_zero(num_a, den_a):
+    return np.divide(num_a, den_a, out=np.zeros_like(num_a), where=den_a!=0)
+
+
+# In[13]:
+
+def float_outputs(result):
+    if isinstance(result, tuple):
+        return [arr for arr in result if isinstance(arr, np.ndarray) and (arr.dtype.kind == 'f')]
+    return [result]
+
+
+# Calls stage(*args, dtype=..., **kwargs) in float64 and in float32 and compares every floating-point output
+
+# In[14]:
+
+def compare_precision(stage, *args, floor=1e-6, **kwargs):
+    t0 = time.perf_counter()
+    ref = stage(*args, dtype=np.float64, **kwargs)
+    seconds_64 = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    test = stage(*args, dtype=np.float32, **kwargs)
+    seconds_32 = time.perf_counter() - t0
+
+    deviations = [max_rel_deviation(r, t, floor) for r, t in zip(float_outputs(ref), float_outputs(test))]
+    report = {'max_rel_dev': max(deviations), 'per_output': deviations,
+              'seconds_64': seconds_64, 'seconds_32': seconds_32}
+    return report